@@ -0,0 +1,201 @@
+"""Startup and command latency benchmarks of timeflow
+
+Generates a synthetic log file, runs timeflow commands against it in
+separate interpreters and times in-process hot paths of log_parser and
+helpers. Results are printed as JSON, and can be compared with results
+of an earlier run to catch regressions, e.g.:
+
+    python benchmarks/bench.py --days 3650 --output bench.json
+    python benchmarks/bench.py --days 3650 --compare bench.json
+"""
+from __future__ import print_function
+
+from datetime import datetime as dt
+from datetime import timedelta
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+RUN_TIMEFLOW = "import sys; from timeflow.main import main; main(sys.argv[1:])"
+
+
+def generate_log(path, days, entries_per_day, slack_ratio, projects, seed=0):
+    """Writes synthetic log file of days, which ends today
+
+    Returns first and last dates of log.
+    """
+    rnd = random.Random(seed)
+    project_names = ['Project{}'.format(i) for i in range(projects)]
+    last_day = dt.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    first_day = last_day - timedelta(days=days - 1)
+
+    with open(path, 'w') as fp:
+        fp.write('# synthetic timeflow log\n')
+        for day in range(days):
+            date = first_day + timedelta(days=day)
+            minute = 8 * 60
+            lines = ['{} Arrived.'.format((date + timedelta(minutes=minute)).strftime('%Y-%m-%d %H:%M'))]
+            for entry in range(entries_per_day - 1):
+                minute = min(minute + rnd.randint(5, 60), 24 * 60 - 1)
+                stamp = (date + timedelta(minutes=minute)).strftime('%Y-%m-%d %H:%M')
+                project = rnd.choice(project_names)
+                message = '{} {}: task #{}'.format(stamp, project, rnd.randint(1, 50))
+                if rnd.random() < slack_ratio:
+                    message += ' **'
+                lines.append(message)
+            fp.write('\n'.join(lines) + '\n\n')
+    return first_day.strftime('%Y-%m-%d'), last_day.strftime('%Y-%m-%d')
+
+
+def time_command(args, env, repeat):
+    "Returns best wall time in seconds of running args in a new process"
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.check_call(args, env=env, stdout=devnull, stderr=devnull)
+            times.append(time.time() - start)
+    return min(times)
+
+
+def bench_commands(env, first_date, last_date, repeat):
+    python = [sys.executable]
+    timeflow = python + ['-c', RUN_TIMEFLOW]
+    ranges = {
+        'day': ['--day', last_date],
+        'week': ['--week', last_date],
+        'month': ['--month', last_date[:7]],
+        'all': ['--from', first_date, '--to', last_date],
+    }
+
+    results = {
+        'startup/python': time_command(python + ['-c', 'pass'], env, repeat),
+        'startup/import': time_command(python + ['-c', 'import timeflow.main'], env, repeat),
+    }
+    for cache in ('0', '1'):
+        cache_env = dict(env, TIMEFLOW_CACHE=cache)
+        name = 'cache' if cache == '1' else 'nocache'
+        # warm up snapshot and index, so each run measures the steady state
+        subprocess.check_call(timeflow + ['stats'], env=cache_env, stdout=subprocess.PIPE)
+        for range_name, range_args in sorted(ranges.items()):
+            results['stats/{}/{}'.format(name, range_name)] = time_command(
+                timeflow + ['stats'] + range_args, cache_env, repeat)
+            results['stats-report/{}/{}'.format(name, range_name)] = time_command(
+                timeflow + ['stats', '-r'] + range_args, cache_env, repeat)
+    # log goes last, as it changes the log file
+    results['log'] = time_command(timeflow + ['log', 'Benchmark: log entry'], env, repeat)
+    return results
+
+
+def bench_hot_paths(log_file, first_date, last_date, repeat):
+    from timeflow import helpers, log_parser
+    from timeflow.columnar import ColumnarLog
+
+    helpers.LOG_FILE = log_file
+    lines = helpers.read_log_file_lines()
+    # checked once per loaded log, like ParsedLog does
+    ordered = helpers.is_ordered(lines)
+    parsed = log_parser.parse_lines(lines)
+    columnar_log = ColumnarLog.from_lines(lines)
+    pairs = list(zip(parsed, parsed[1:]))
+
+    def calc_time_diffs():
+        for line, next_line in pairs:
+            log_parser.calc_time_diff(line, next_line)
+
+    hot_paths = {
+        'helpers.read_log_file_lines': helpers.read_log_file_lines,
+        'helpers.date_begins': lambda: helpers.date_begins(lines, last_date, ordered=ordered),
+        'helpers.date_ends': lambda: helpers.date_ends(lines, first_date, ordered=ordered),
+        'log_parser.parse_lines': lambda: log_parser.parse_lines(lines),
+        'log_parser.calc_time_diff': calc_time_diffs,
+        'log_parser.calculate': lambda: log_parser.calculate(lines, first_date, last_date),
+        'columnar.from_lines': lambda: ColumnarLog.from_lines(lines),
+        'columnar.calculate': lambda: log_parser.calculate(columnar_log, first_date, last_date),
+    }
+    return dict(
+        (name, min(timeit.repeat(fn, number=1, repeat=repeat)))
+        for name, fn in hot_paths.items()
+    )
+
+
+def compare(results, baseline, threshold):
+    "Returns names of benchmarks, which got slower than threshold times baseline"
+    return sorted(
+        name for name, seconds in results.items()
+        if name in baseline and seconds > baseline[name] * threshold
+    )
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=365, help="Number of days in generated log")
+    parser.add_argument("--entries-per-day", type=int, default=12, help="Number of entries per day")
+    parser.add_argument("--slack-ratio", type=float, default=0.2, help="Part of entries marked as slack")
+    parser.add_argument("--projects", type=int, default=20, help="Number of distinct projects")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs, the best one is reported")
+    parser.add_argument("--output", help="Write JSON results to file instead of stdout")
+    parser.add_argument("--compare", metavar="JSON", help="Fail if results regressed from earlier results")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Allowed slowdown factor, when comparing results (default: 1.25)")
+    return parser.parse_args(args)
+
+
+def main(args=sys.argv[1:]):
+    args = parse_args(args)
+    home = tempfile.mkdtemp()
+    try:
+        log_file = os.path.join(home, 'timelog.txt')
+        first_date, last_date = generate_log(
+            log_file, args.days, args.entries_per_day, args.slack_ratio, args.projects)
+
+        # TIMEFLOW_LOG_FILE of the environment would point commands to another log file
+        env = dict(os.environ, HOME=home, XDG_CACHE_HOME=os.path.join(home, '.cache'),
+                   TIMEFLOW_LOG_FILE=log_file)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT_DIR, env.get('PYTHONPATH')]))
+
+        results = {
+            'python': platform.python_version(),
+            'params': {
+                'days': args.days,
+                'entries_per_day': args.entries_per_day,
+                'slack_ratio': args.slack_ratio,
+                'projects': args.projects,
+                'log_size': os.path.getsize(log_file),
+            },
+            'hot_paths': bench_hot_paths(log_file, first_date, last_date, args.repeat),
+            'commands': bench_commands(env, first_date, last_date, args.repeat),
+        }
+    finally:
+        shutil.rmtree(home)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        regressed = (
+            compare(results['hot_paths'], baseline.get('hot_paths', {}), args.threshold)
+            + compare(results['commands'], baseline.get('commands', {}), args.threshold)
+        )
+        if regressed:
+            sys.exit('Regressed benchmarks: {}'.format(', '.join(regressed)))
+
+
+if __name__ == "__main__":
+    main()
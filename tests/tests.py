@@ -1,7 +1,13 @@
+from array import array
 import datetime
+import gzip
+import json
 import os
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
 import unittest
 
 try:
@@ -11,8 +17,22 @@ except ImportError:
     import mock
     from StringIO import StringIO
 
+from timeflow import binlog
+from timeflow import cache
+from timeflow import client
+from timeflow import columnar
+from timeflow import daemon
+from timeflow import export
 from timeflow import helpers
-from timeflow.arg_parser import parse_args
+from timeflow import importer
+from timeflow import log_index
+from timeflow import log_parser
+from timeflow import main
+from timeflow import multilog
+from timeflow import storage
+from timeflow import summaries
+from timeflow import watch
+from timeflow.arg_parser import calculate_log_stats, calculate_period_stats, parse_args
 
 
 class FakeDateTime(datetime.datetime):
@@ -30,6 +50,15 @@ class TestArgParser(unittest.TestCase):
         # overwrite log file setting, to define file to be used in tests
         helpers.LOG_FILE = self.test_dir + '/fake_log.txt'
 
+        # keep parsed log snapshots out of user's cache directory
+        self.cache_home = tempfile.mkdtemp()
+        self.environ = mock.patch.dict('os.environ', {'XDG_CACHE_HOME': self.cache_home})
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.cache_home)
+
     def mock_subprocess(*args, **kwargs):
         return 'mocked'
 
@@ -59,9 +88,27 @@ class TestArgParser(unittest.TestCase):
             # if test file is not the same as real log file - remove it
             if helpers.LOG_FILE is not self.real_log_file:
                 os.remove(helpers.LOG_FILE)
+                os.remove(log_index.index_path(helpers.LOG_FILE))
         except OSError:
             pass
 
+    def test_log_stdin(self):
+        helpers.LOG_FILE = self.test_dir + '/auto_fake_log.txt'
+        stdin = StringIO('2015-01-01 08:00 Arrived.\n\n2015-01-02 08:00 Arrived.\r\nWork: task\n')
+        try:
+            with mock.patch('timeflow.arg_parser.sys.stdin', stdin), \
+                 mock.patch('timeflow.helpers.dt', FakeDateTime):
+                FakeDateTime.now = classmethod(lambda cls: datetime.datetime(2015, 1, 3, 9, 0))
+                args = parse_args(['log', '--stdin'])
+                args.func(args)
+            with open(helpers.LOG_FILE) as fp:
+                self.assertEqual(fp.read(), '2015-01-01 08:00 Arrived.\n\n2015-01-02 08:00 Arrived.\n'
+                                            '\n2015-01-03 09:00 Work: task\n')
+        finally:
+            for path in (helpers.LOG_FILE, log_index.index_path(helpers.LOG_FILE), storage.lock_path(helpers.LOG_FILE)):
+                if os.path.exists(path):
+                    os.remove(path)
+
     def test_edit(self):
         subprocess.call = self.mock_subprocess
         with mock.patch.dict('os.environ', {'EDITOR': 'vim'}):
@@ -215,6 +262,1087 @@ Slack: 0h 25m (35.71%)
 
 Today working for: 16h 00m""")
 
+    def test_version(self):
+        sys.stdout = StringIO()
+        with mock.patch('timeflow.arg_parser.get_version', return_value='1.2.3'), \
+             mock.patch('argparse.ArgumentParser.exit', side_effect=SystemExit) as exit:
+            self.assertRaises(SystemExit, parse_args, ['-v'])
+        exit.assert_called_with(message='timeflow 1.2.3\n')
+
+    def test_profile(self):
+        sys.stdout = StringIO()
+        profile_output = os.path.join(self.cache_home, 'stats.prof')
+        with mock.patch('sys.stderr', StringIO()) as stderr:
+            main.main(['--profile-output', profile_output, 'stats', '-d', '2015-01-01', '-r'])
+        self.assertIn('WORK 2h 50m', sys.stdout.getvalue())
+        report = stderr.getvalue()
+        for phase in ('import', 'read', 'date lookup', 'aggregation', 'rendering', 'total'):
+            self.assertIn('  ' + phase + ' ', report)
+        self.assertTrue(os.path.exists(profile_output))
+
+        with mock.patch.dict('os.environ', {'TIMEFLOW_PROFILE': '1'}):
+            self.assertTrue(parse_args(['stats']).profile)
+        with mock.patch.dict('os.environ', {'TIMEFLOW_PROFILE': '0'}):
+            self.assertFalse(parse_args(['stats']).profile)
+
+
+class TestHelpers(unittest.TestCase):
+
+    def setUp(self):
+        self.lines = [
+            '2015-01-01 08:00 Arrived.\n',
+            '2015-01-01 09:15 Timeflow: start project\n',
+            '2015-01-03 08:00 Arrived.\n',
+            '2015-01-03 10:00 Django: read documentation\n',
+            '2015-01-05 08:00 Arrived.\n',
+        ]
+
+    def test_date_begins(self):
+        self.assertEqual(helpers.date_begins(self.lines, '2014-12-31'), 0)
+        self.assertEqual(helpers.date_begins(self.lines, '2015-01-01'), 0)
+        self.assertEqual(helpers.date_begins(self.lines, '2015-01-02'), 2)
+        self.assertEqual(helpers.date_begins(self.lines, '2015-01-03'), 2)
+        self.assertEqual(helpers.date_begins(self.lines, '2015-01-06'), None)
+        self.assertEqual(helpers.date_begins([], '2015-01-01'), None)
+
+    def test_date_ends(self):
+        self.assertEqual(helpers.date_ends(self.lines, '2014-12-31'), None)
+        self.assertEqual(helpers.date_ends(self.lines, '2015-01-01'), 1)
+        self.assertEqual(helpers.date_ends(self.lines, '2015-01-02'), 1)
+        self.assertEqual(helpers.date_ends(self.lines, '2015-01-03'), 3)
+        self.assertEqual(helpers.date_ends(self.lines, '2015-01-06'), 4)
+
+    def test_read_last_entry(self):
+        real_log_file = helpers.LOG_FILE
+        test_dir = os.path.dirname(os.path.realpath(__file__))
+        helpers.LOG_FILE = test_dir + '/auto_fake_log.txt'
+        try:
+            self.assertEqual(helpers.read_last_entry(), None)
+            with open(helpers.LOG_FILE, 'w') as fp:
+                fp.writelines(self.lines + ['\n', '# comment\n', '\n'])
+            for block_size in (1, 7, 4096):
+                with mock.patch('timeflow.helpers.TAIL_BLOCK_SIZE', block_size):
+                    self.assertEqual(helpers.read_last_entry(), self.lines[-1])
+        finally:
+            if os.path.exists(helpers.LOG_FILE):
+                os.remove(helpers.LOG_FILE)
+            helpers.LOG_FILE = real_log_file
+
+    def test_iter_log_file_lines(self):
+        real_log_file = helpers.LOG_FILE
+        test_dir = os.path.dirname(os.path.realpath(__file__))
+        helpers.LOG_FILE = test_dir + '/auto_fake_log.txt'
+        try:
+            open(helpers.LOG_FILE, 'w').close()
+            self.assertEqual(list(helpers.iter_log_file_lines()), [])
+
+            with open(helpers.LOG_FILE, 'wb') as fp:
+                fp.write(b'# comment\r\n\r\n' + ''.join(self.lines).replace('\n', '\r\n').encode('utf-8'))
+            self.assertEqual(list(helpers.iter_log_file_lines()), self.lines)
+            self.assertEqual(helpers.read_log_file_lines(), self.lines)
+        finally:
+            os.remove(helpers.LOG_FILE)
+            helpers.LOG_FILE = real_log_file
+
+    def test_write_messages_concurrently(self):
+        real_log_file = helpers.LOG_FILE
+        test_dir = os.path.dirname(os.path.realpath(__file__))
+        helpers.LOG_FILE = test_dir + '/auto_fake_log.txt'
+        cache_home = tempfile.mkdtemp()
+        try:
+            with open(helpers.LOG_FILE, 'w') as fp:
+                fp.writelines(self.lines)
+            with mock.patch.dict('os.environ', {'XDG_CACHE_HOME': cache_home}), \
+                 mock.patch('timeflow.helpers.dt', FakeDateTime):
+                FakeDateTime.now = classmethod(lambda cls: datetime.datetime(2015, 1, 6, 9, 0))
+                threads = [threading.Thread(target=helpers.write_messages, args=(['Work: task'] * 10,))
+                           for _ in range(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            with open(helpers.LOG_FILE) as fp:
+                appended = fp.readlines()[len(self.lines):]
+            # only the first batch starts a new day
+            self.assertEqual(appended, ['\n'] + ['2015-01-06 09:00 Work: task\n'] * 80)
+        finally:
+            for path in (helpers.LOG_FILE, log_index.index_path(helpers.LOG_FILE), storage.lock_path(helpers.LOG_FILE)):
+                if os.path.exists(path):
+                    os.remove(path)
+            shutil.rmtree(cache_home)
+            helpers.LOG_FILE = real_log_file
+
+    @unittest.skipIf(storage.fcntl is None, "advisory locks are not supported")
+    def test_lock_of_replaced_log_file(self):
+        real_log_file = helpers.LOG_FILE
+        tmp_dir = tempfile.mkdtemp()
+        helpers.LOG_FILE = tmp_dir + '/timelog.txt'
+        try:
+            with mock.patch.dict('os.environ', {'XDG_CACHE_HOME': tmp_dir + '/cache'}):
+                with storage.locked(helpers.LOG_FILE):
+                    # log file is replaced, e.g. by import, while it's locked
+                    storage.get_storage().write(self.lines)
+                    writer = threading.Thread(target=helpers.write_messages, args=(['2015-01-05 09:00 Work: task'],))
+                    writer.start()
+                    writer.join(0.2)
+                    self.assertTrue(writer.is_alive())
+                writer.join()
+
+            with open(helpers.LOG_FILE) as fp:
+                self.assertEqual(fp.readlines(), self.lines + ['2015-01-05 09:00 Work: task\n'])
+        finally:
+            shutil.rmtree(tmp_dir)
+            helpers.LOG_FILE = real_log_file
+
+    def test_find_date_line_out_of_order(self):
+        lines = [self.lines[2], self.lines[0], self.lines[4], self.lines[1]]
+        self.assertEqual(helpers.date_begins(lines, '2015-01-02'), 0)
+        self.assertEqual(helpers.date_ends(lines, '2015-01-02'), 3)
+        self.assertEqual(helpers.date_begins(lines, '2015-01-04'), 2)
+
+        # neighbours of bisection result and log edges are in order, but lines aren't
+        lines = [self.lines[0], self.lines[4], '2015-01-02 08:00 Arrived.\n', '2015-01-06 08:00 Arrived.\n']
+        self.assertEqual(helpers.date_begins(lines, '2015-01-03'), 1)
+        self.assertEqual(helpers.date_begins(lines, '2015-01-03', ordered=True), 3)
+        parsed = list(log_parser.ParsedLog(lines).iter_range('2015-01-03', '2015-01-03'))
+        self.assertEqual([line.date for line in parsed], ['2015-01-05', '2015-01-02'])
+
+        log = columnar.ColumnarLog.from_lines(lines)
+        self.assertFalse(log.ordered)
+        columns = log.to_columns()
+        del columns['ordered']
+        self.assertFalse(columnar.ColumnarLog.from_columns(columns).ordered)
+        self.assertTrue(columnar.ColumnarLog.from_lines(self.lines).ordered)
+
+    def test_order_checked_once(self):
+        with mock.patch('timeflow.log_parser.is_ordered', wraps=helpers.is_ordered) as check:
+            log = log_parser.ParsedLog(self.lines)
+            log_parser.calculate(log, '2015-01-01', '2015-01-01')
+            log_parser.calculate(log, '2015-01-02', '2015-01-02')
+        self.assertEqual(check.call_count, 1)
+
+        # lines of unknown order are scanned without checking them first
+        with mock.patch('timeflow.helpers.is_ordered') as check:
+            self.assertEqual(helpers.date_begins(self.lines, '2015-01-02'),
+                             helpers.date_begins(self.lines, '2015-01-02', ordered=True))
+        self.assertEqual(check.call_count, 0)
+
+
+class TestLogParser(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = os.path.dirname(os.path.realpath(__file__))
+        self.real_log_file = helpers.LOG_FILE
+        helpers.LOG_FILE = self.test_dir + '/fake_log.txt'
+
+    def tearDown(self):
+        helpers.LOG_FILE = self.real_log_file
+
+    def test_parsed_log_read_once(self):
+        with mock.patch('timeflow.log_parser.read_log_file_lines',
+                        wraps=helpers.read_log_file_lines) as read_lines:
+            log = log_parser.ParsedLog()
+            log_parser.calculate_stats(log, '2015-01-01', '2015-01-02')
+            log_parser.calculate_report(log, '2015-01-01', '2015-01-02')
+        self.assertEqual(read_lines.call_count, 1)
+
+    def test_time_without_zero_padding(self):
+        lines = ['2016-01-01 08:00 Arrived.\n', '2016-01-01 8:30 Work: x\n', '2016-01-01 9:05 Work: y\n']
+        self.assertEqual(log_parser.parse_line(lines[1]).minute, log_parser.date_to_minutes('2016-01-01') + 510)
+        work_time, _, _, work_dict, _ = log_parser.calculate(lines, '2016-01-01', '2016-01-01')
+        self.assertEqual(sum(work_time), 3900)
+        self.assertEqual(work_dict, {'Work': {'x': 1800, 'y': 2100}})
+
+    def test_merge_report(self):
+        report_dict = log_parser.new_report_dict()
+        report_dict['Project']['Log'] = 60
+        log_parser.merge_report(report_dict, {'Project': {'Log': 30, 'Other': 10}, 'New': {'Log': 5}})
+        self.assertEqual(report_dict, {'Project': {'Log': 90, 'Other': 10}, 'New': {'Log': 5}})
+
+    def test_calculate_periods(self):
+        lines = helpers.read_log_file_lines()
+        periods = log_parser.calculate_periods(lines, '2015-01-01', '2015-01-02')
+        self.assertEqual(list(periods), ['2015-01-01', '2015-01-02'])
+        for date, (work_time, slack_time, work_dict, slack_dict) in periods.items():
+            expected = log_parser.calculate(lines, date, date)
+            self.assertEqual((work_time, slack_time, work_dict, slack_dict), expected[:2] + expected[3:])
+
+        work_time, slack_time, _, work_dict, slack_dict = log_parser.calculate(lines, '2015-01-01', '2015-01-02')
+        for by, period in (('week', '2015-W01'), ('month', '2015-01')):
+            periods = log_parser.calculate_periods(lines, '2015-01-01', '2015-01-02', by=by)
+            self.assertEqual(list(periods), [period])
+            self.assertEqual(periods[period], (work_time, slack_time, work_dict, slack_dict))
+
+        # lines of a period, which aren't next to each other, are merged
+        periods = log_parser.calculate_periods(lines[5:] + lines[:5], '2015-01-01', '2015-01-02', by='week')
+        self.assertEqual(sum(periods['2015-W01'][0]), sum(work_time))
+
+    def test_parse_range_is_lazy(self):
+        lines = helpers.read_log_file_lines()
+        with mock.patch('timeflow.log_parser.parse_line',
+                        wraps=log_parser.parse_line) as parse_line:
+            data = log_parser.parse_range(lines, '2015-01-02', '2015-01-02')
+            self.assertEqual(parse_line.call_count, 0)
+            self.assertEqual([line.time for line in data],
+                             ['08:25', '09:15', '10:00', '10:25', '12:00', '13:05'])
+        self.assertEqual(parse_line.call_count, 6)
+        self.assertEqual(list(log_parser.parse_range(lines, '2015-01-03', '2015-01-04')), [])
+
+    def test_calc_time_diff(self):
+        pairs = [
+            ('2015-01-01 08:00 Arrived.', '2015-01-01 09:15 Timeflow: start project'),
+            ('2015-01-01 09:15 Arrived.', '2015-01-01 09:15 Timeflow: start project'),
+            ('2015-01-01 12:00 Arrived.', '2015-01-01 09:15 Timeflow: start project'),
+            ('2016-02-28 23:59 Arrived.', '2016-02-29 00:01 Timeflow: start project'),
+        ]
+        for line, next_line in pairs:
+            line, next_line = log_parser.parse_line(line), log_parser.parse_line(next_line)
+            expected = (
+                datetime.datetime.strptime(next_line.date + next_line.time, '%Y-%m-%d%H:%M')
+                - datetime.datetime.strptime(line.date + line.time, '%Y-%m-%d%H:%M')
+            ).seconds
+            self.assertEqual(log_parser.calc_time_diff(line, next_line), expected)
+
+    def test_calculate(self):
+        log = log_parser.ParsedLog()
+        work_time, slack_time, _, work_dict, slack_dict = log_parser.calculate(
+            log, '2015-01-01', '2015-01-02')
+        self.assertEqual(sum(work_time), 6 * 3600)
+        self.assertEqual(sum(slack_time), 2 * 3600 + 40 * 60)
+        self.assertEqual(dict(work_dict['Work']), {
+            'finish task #115': 45 * 60,
+            'working on task #42': 95 * 60,
+        })
+        self.assertEqual(dict(slack_dict['Other']), {
+            'Breakfast ': 45 * 60,
+            'Lunch ': 65 * 60,
+        })
+    def test_columnar_log(self):
+        lines = helpers.read_log_file_lines()
+        columnar_log = columnar.ColumnarLog.from_lines(lines)
+        self.assertEqual(len(columnar_log), len(lines))
+        self.assertEqual(len(columnar_log.projects), 6)
+        for row, line in zip(columnar_log, log_parser.parse_lines(lines)):
+            self.assertEqual(
+                (row.date, row.time, row.project, row.log, row.is_slack, row.minute),
+                (line.date, line.time, line.project, line.log, line.is_slack, line.minute))
+
+    def test_columnar_aggregate(self):
+        lines = helpers.read_log_file_lines()
+        # out of order times and repeated logs
+        lines += ['2015-01-04 10:00 Work: task\n', '2015-01-04 09:00 Work: task\n',
+                  '2015-01-04 11:00 Work: task\n', '2015-01-04 11:30 Work: task **\n']
+        columnar_log = columnar.ColumnarLog.from_lines(lines)
+        engines = [None]
+        if columnar._get_numpy() is not None:
+            engines.append(columnar._get_numpy())
+
+        for numpy in engines:
+            with mock.patch('timeflow.columnar._get_numpy', return_value=numpy), \
+                 mock.patch('timeflow.columnar.NUMPY_MIN_ROWS', 0):
+                for date_from, date_to in [('2015-01-01', '2015-01-01'),
+                                           ('2015-01-01', '2015-01-02'),
+                                           ('2015-01-02', '2015-01-05'),
+                                           ('2015-01-03', '2015-01-05'),
+                                           ('2015-01-05', '2015-01-05')]:
+                    expected = log_parser.calculate(lines, date_from, date_to)
+                    result = log_parser.calculate(columnar_log, date_from, date_to)
+                    self.assertEqual(result, expected)
+                    for report, expected_report in zip(result[3:], expected[3:]):
+                        self.assertEqual([list(logs) for logs in report.values()],
+                                         [list(logs) for logs in expected_report.values()])
+
+
+class TestLogIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = os.path.dirname(os.path.realpath(__file__))
+        self.real_log_file = helpers.LOG_FILE
+        helpers.LOG_FILE = self.test_dir + '/auto_fake_log.txt'
+        with open(self.test_dir + '/fake_log.txt') as src:
+            with open(helpers.LOG_FILE, 'w') as dst:
+                dst.write(src.read())
+
+    def tearDown(self):
+        for path in (helpers.LOG_FILE, log_index.index_path(helpers.LOG_FILE), storage.lock_path(helpers.LOG_FILE)):
+            if os.path.exists(path):
+                os.remove(path)
+        helpers.LOG_FILE = self.real_log_file
+
+    def test_read_range(self):
+        lines = helpers.read_log_file_lines()
+        # without index whole file is read
+        self.assertEqual(helpers.read_log_file_lines('2015-01-02', '2015-01-02'), lines)
+
+        helpers.rebuild_log_index()
+        index = log_index.load_index(helpers.LOG_FILE)
+        self.assertEqual([date for date, _ in index['dates']], ['2015-01-01', '2015-01-02'])
+        self.assertEqual(helpers.read_log_file_lines('2015-01-02', '2015-01-02'), lines[5:])
+        self.assertEqual(helpers.read_log_file_lines('2015-01-01', '2015-01-01'), lines[:5])
+        self.assertEqual(helpers.read_log_file_lines('2014-12-01', '2015-01-05'), lines)
+        self.assertEqual(helpers.read_log_file_lines('2015-01-03', '2015-01-05'), [])
+
+    def test_parsed_log_streams_range(self):
+        lines = helpers.read_log_file_lines()
+        expected = log_parser.calculate(lines, '2015-01-02', '2015-01-02')
+        helpers.rebuild_log_index()
+        with mock.patch('timeflow.log_parser.read_log_file_lines') as read_lines:
+            log = log_parser.ParsedLog()
+            self.assertEqual(log_parser.calculate(log, '2015-01-02', '2015-01-02'), expected)
+        # indexed log file isn't read into a list
+        self.assertEqual(read_lines.call_count, 0)
+
+    def test_update_on_write(self):
+        helpers.rebuild_log_index()
+        with mock.patch('timeflow.helpers.dt', FakeDateTime):
+            FakeDateTime.now = classmethod(lambda cls: datetime.datetime(2015, 1, 3, 8))
+            helpers.write_to_log_file('Arrived.')
+
+        index = log_index.load_index(helpers.LOG_FILE)
+        self.assertEqual(index, log_index.build_index(helpers.LOG_FILE))
+        self.assertEqual(helpers.read_log_file_lines('2015-01-03', '2015-01-03'),
+                         ['2015-01-03 08:00 Arrived.\n'])
+
+    def test_stale_index(self):
+        helpers.rebuild_log_index()
+        with open(helpers.LOG_FILE, 'a') as fp:
+            fp.write('\n2015-01-03 08:00 Arrived.\n')
+        self.assertEqual(log_index.load_index(helpers.LOG_FILE), None)
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = os.path.dirname(os.path.realpath(__file__))
+        self.real_log_file = helpers.LOG_FILE
+        helpers.LOG_FILE = self.test_dir + '/auto_fake_log.txt'
+        with open(self.test_dir + '/fake_log.txt') as src:
+            with open(helpers.LOG_FILE, 'w') as dst:
+                dst.write(src.read())
+
+        self.cache_home = tempfile.mkdtemp()
+        self.environ = mock.patch.dict('os.environ', {'XDG_CACHE_HOME': self.cache_home})
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.cache_home)
+        os.remove(helpers.LOG_FILE)
+        helpers.LOG_FILE = self.real_log_file
+
+    def load_log(self):
+        "Returns loaded log and number of parsed lines"
+        with mock.patch('timeflow.cache.parse_line', wraps=log_parser.parse_line) as parse_line:
+            log = cache.load_log()
+        return log, parse_line.call_count
+
+    def assert_log(self, log):
+        lines = helpers.read_log_file_lines()
+        self.assertEqual([(row.minute, row.project, row.log, row.is_slack) for row in log],
+                         [(line.minute, line.project, line.log, line.is_slack)
+                          for line in log_parser.parse_lines(lines)])
+
+    def test_snapshot(self):
+        log, parsed = self.load_log()
+        self.assert_log(log)
+        self.assertEqual(parsed, 11)
+
+        log, parsed = self.load_log()
+        self.assert_log(log)
+        self.assertEqual(parsed, 0)
+
+    def test_appended(self):
+        self.load_log()
+        with open(helpers.LOG_FILE, 'a') as fp:
+            fp.write('\n2015-01-03 08:00 Arrived.\n2015-01-03 09:00 Work: task')
+
+        # last line is not finished, so it's parsed but not cached
+        log, parsed = self.load_log()
+        self.assert_log(log)
+        self.assertEqual(parsed, 2)
+
+        with open(helpers.LOG_FILE, 'a') as fp:
+            fp.write('\n')
+        log, parsed = self.load_log()
+        self.assert_log(log)
+        self.assertEqual(parsed, 1)
+
+    def test_refresh_other_log_file(self):
+        other_log_file = self.cache_home + '/other.txt'
+        with open(other_log_file, 'w') as fp:
+            fp.write('2015-01-05 08:00 Arrived.\n2015-01-05 09:00 Work: task\n')
+        log, state, _ = cache.refresh(other_log_file)
+        self.assertEqual([row.project for row in log], ['Arrived.', 'Work'])
+        self.assertEqual(state['rows'], 2)
+
+    def test_edited(self):
+        self.load_log()
+        with open(helpers.LOG_FILE) as fp:
+            content = fp.read()
+        with open(helpers.LOG_FILE, 'w') as fp:
+            fp.write(content.replace('Breakfast', 'Lunch') + '2015-01-02 14:00 Work: task\n')
+
+        log, parsed = self.load_log()
+        self.assert_log(log)
+        self.assertEqual(parsed, 12)
+
+
+class TestSummaries(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = os.path.dirname(os.path.realpath(__file__))
+        self.real_log_file = helpers.LOG_FILE
+        helpers.LOG_FILE = self.test_dir + '/auto_fake_log.txt'
+        with open(self.test_dir + '/fake_log.txt') as src:
+            with open(helpers.LOG_FILE, 'w') as dst:
+                dst.write(src.read())
+        helpers.rebuild_log_index()
+
+        self.cache_home = tempfile.mkdtemp()
+        self.environ = mock.patch.dict('os.environ', {'XDG_CACHE_HOME': self.cache_home})
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.cache_home)
+        for path in (helpers.LOG_FILE, log_index.index_path(helpers.LOG_FILE), storage.lock_path(helpers.LOG_FILE)):
+            if os.path.exists(path):
+                os.remove(path)
+        helpers.LOG_FILE = self.real_log_file
+
+    def calculate(self, date_from, date_to):
+        "Returns stats calculated from summaries and number of computed day records"
+        with mock.patch('timeflow.summaries._make_record', wraps=summaries._make_record) as make_record:
+            result = summaries.calculate(date_from, date_to)
+        return result, make_record.call_count
+
+    def assert_stats(self, result, date_from, date_to):
+        work_time, slack_time, _, work_dict, slack_dict = log_parser.calculate(
+            helpers.read_log_file_lines(), date_from, date_to)
+        self.assertEqual((sum(result[0]), sum(result[1])), (sum(work_time), sum(slack_time)))
+        self.assertEqual(result[3:], (work_dict, slack_dict))
+
+    def test_calculate(self):
+        result, computed = self.calculate('2015-01-01', '2015-01-02')
+        self.assert_stats(result, '2015-01-01', '2015-01-02')
+        self.assertEqual(result[:2], ([170 * 60, 190 * 60], [70 * 60, 90 * 60]))
+        self.assertEqual(computed, 2)
+
+        result, computed = self.calculate('2015-01-02', '2015-01-31')
+        self.assert_stats(result, '2015-01-02', '2015-01-31')
+        self.assertEqual(computed, 0)
+
+    def test_update_on_write(self):
+        self.calculate('2015-01-01', '2015-01-02')
+        with mock.patch('timeflow.helpers.dt', FakeDateTime):
+            FakeDateTime.now = classmethod(lambda cls: datetime.datetime(2015, 1, 2, 14, 0))
+            helpers.write_to_log_file('Work: working on task #42')
+
+        result, computed = self.calculate('2015-01-01', '2015-01-02')
+        self.assert_stats(result, '2015-01-01', '2015-01-02')
+        self.assertEqual(computed, 0)
+
+    def test_edited(self):
+        self.calculate('2015-01-01', '2015-01-02')
+        with open(helpers.LOG_FILE) as fp:
+            content = fp.read()
+        with open(helpers.LOG_FILE, 'w') as fp:
+            fp.write(content.replace('2015-01-02 13:05 Lunch **', '2015-01-02 13:35 Lunch **'))
+        helpers.rebuild_log_index()
+
+        # only the edited day is computed again
+        result, computed = self.calculate('2015-01-01', '2015-01-02')
+        self.assert_stats(result, '2015-01-01', '2015-01-02')
+        self.assertEqual(computed, 1)
+
+    def test_split_range(self):
+        self.assertEqual(summaries.split_range('2015-01-01', '2015-12-31'), ['2015'])
+        self.assertEqual(
+            summaries.split_range('2014-12-30', '2016-02-09'),
+            ['2014-12-30', '2014-12-31', '2015', '2016-01', '2016-W05', '2016-02-08', '2016-02-09'])
+        # week crossing a month boundary is used, when the next month isn't covered
+        self.assertEqual(summaries.split_range('2015-01-26', '2015-02-08'), ['2015-W05', '2015-W06'])
+        self.assertEqual(summaries.period_range('2015-W01'), ('2014-12-29', '2015-01-04'))
+        self.assertEqual(summaries.period_range('2016-02'), ('2016-02-01', '2016-02-29'))
+
+    def test_rollups(self):
+        result, computed = self.calculate('2014-01-01', '2015-12-31')
+        self.assert_stats(result, '2014-01-01', '2015-12-31')
+        self.assertEqual(computed, 2)
+        self.assertEqual(sorted(os.listdir(summaries.rollups_dir(helpers.LOG_FILE))),
+                         ['2015'] + ['2015-{:02}'.format(month) for month in range(1, 13)])
+
+        with mock.patch('timeflow.helpers.dt', FakeDateTime):
+            FakeDateTime.now = classmethod(lambda cls: datetime.datetime(2015, 1, 2, 14, 0))
+            helpers.write_to_log_file('Work: working on task #42')
+        self.assertEqual(sorted(os.listdir(summaries.rollups_dir(helpers.LOG_FILE))),
+                         ['2015-{:02}'.format(month) for month in range(2, 13)])
+
+        result, computed = self.calculate('2014-01-01', '2015-12-31')
+        self.assert_stats(result, '2014-01-01', '2015-12-31')
+        self.assertEqual(computed, 0)
+
+    def test_out_of_order(self):
+        with open(helpers.LOG_FILE, 'a') as fp:
+            fp.write('2015-01-01 18:00 Work: late entry\n')
+        helpers.rebuild_log_index()
+        self.assertEqual(summaries.calculate('2015-01-01', '2015-01-02'), None)
+
+
+class TestBinLog(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = os.path.dirname(os.path.realpath(__file__))
+        self.real_log_file = helpers.LOG_FILE
+        self.tmp_dir = tempfile.mkdtemp()
+        self.environ = mock.patch.dict('os.environ', {'XDG_CACHE_HOME': self.tmp_dir + '/cache'})
+        self.environ.start()
+        helpers.LOG_FILE = self.tmp_dir + '/timelog.tfb'
+        storage.convert(self.test_dir + '/fake_log.txt', helpers.LOG_FILE)
+
+    def tearDown(self):
+        self.environ.stop()
+        helpers.LOG_FILE = self.real_log_file
+        shutil.rmtree(self.tmp_dir)
+
+    def test_convert(self):
+        with open(self.test_dir + '/fake_log.txt', 'rb') as fp:
+            text = fp.read() + b'2015-01-03  09:00 Extra:  spaces\r\nnot an entry'
+        with open(self.tmp_dir + '/timelog.txt', 'wb') as fp:
+            fp.write(text)
+
+        args = parse_args(['convert', self.tmp_dir + '/timelog.txt', self.tmp_dir + '/converted.tfb'])
+        args.func(args)
+        storage.convert(self.tmp_dir + '/converted.tfb', self.tmp_dir + '/converted.txt')
+        with open(self.tmp_dir + '/converted.txt', 'rb') as fp:
+            self.assertEqual(fp.read(), text)
+
+        with self.assertRaises(SystemExit):
+            storage.convert(self.tmp_dir + '/timelog.txt', self.tmp_dir + '/timelog2.txt')
+
+    def test_read(self):
+        with open(self.test_dir + '/fake_log.txt') as fp:
+            lines = [line for line in fp if helpers._is_valid_line(line)]
+        self.assertEqual(helpers.read_log_file_lines(), lines)
+        self.assertEqual(helpers.read_log_file_lines('2015-01-02', '2015-01-02'), lines[5:])
+        self.assertEqual(helpers.read_last_entry(), lines[-1])
+
+        result = calculate_log_stats('2015-01-01', '2015-01-02')
+        expected = log_parser.calculate(lines, '2015-01-01', '2015-01-02')
+        self.assertEqual(result, expected)
+
+    def test_write(self):
+        with mock.patch('timeflow.helpers.dt', FakeDateTime):
+            FakeDateTime.now = classmethod(lambda cls: datetime.datetime(2015, 1, 3, 9, 0))
+            helpers.write_to_log_file('Arrived.')
+            helpers.write_to_log_file('Work: task #1')
+
+        self.assertEqual(helpers.read_log_file_lines('2015-01-03', '2015-01-03'),
+                         ['2015-01-03 09:00 Arrived.\n', '2015-01-03 09:00 Work: task #1\n'])
+        self.assertEqual(list(binlog.iter_text(helpers.LOG_FILE))[-3], '\n')
+        self.assertEqual(len(binlog.load_log(helpers.LOG_FILE)), 13)
+
+    def test_load_log(self):
+        expected = columnar.ColumnarLog.from_lines(helpers.read_log_file_lines()).to_columns()
+        engines = [None]
+        if columnar._get_numpy() is not None:
+            engines.append(columnar._get_numpy())
+
+        for numpy in engines:
+            with mock.patch('timeflow.columnar._get_numpy', return_value=numpy), \
+                 mock.patch('timeflow.columnar.NUMPY_MIN_ROWS', 0):
+                columns = binlog.load_log(helpers.LOG_FILE).to_columns()
+            for name in ('minutes', 'slack', 'ordered'):
+                self.assertEqual(columns[name], expected[name])
+            self.assertEqual([columns['projects'][i] for i in array('i', columns['project_ids'])],
+                             [expected['projects'][i] for i in array('i', expected['project_ids'])])
+
+    def test_edit(self):
+        def edit_file(args):
+            with open(args[-1], 'a') as fp:
+                fp.write('2015-01-02 14:00 Work: edited\n')
+
+        with mock.patch('timeflow.arg_parser.LOG_FILE', helpers.LOG_FILE), \
+             mock.patch('timeflow.arg_parser.subprocess.call', edit_file):
+            args = parse_args(['edit', '-e', 'vim'])
+            args.func(args)
+        self.assertEqual(helpers.read_last_entry(), '2015-01-02 14:00 Work: edited\n')
+
+
+class TestSqliteStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = os.path.dirname(os.path.realpath(__file__))
+        self.real_log_file = helpers.LOG_FILE
+        self.tmp_dir = tempfile.mkdtemp()
+        self.environ = mock.patch.dict('os.environ', {'XDG_CACHE_HOME': self.tmp_dir + '/cache'})
+        self.environ.start()
+        helpers.LOG_FILE = self.tmp_dir + '/timelog.sqlite'
+        storage.convert(self.test_dir + '/fake_log.txt', helpers.LOG_FILE)
+        with open(self.test_dir + '/fake_log.txt') as fp:
+            self.lines = [line for line in fp if helpers._is_valid_line(line)]
+
+    def tearDown(self):
+        self.environ.stop()
+        helpers.LOG_FILE = self.real_log_file
+        shutil.rmtree(self.tmp_dir)
+
+    def test_convert(self):
+        storage.convert(helpers.LOG_FILE, self.tmp_dir + '/converted.txt')
+        with open(self.test_dir + '/fake_log.txt', 'rb') as fp, \
+             open(self.tmp_dir + '/converted.txt', 'rb') as converted:
+            self.assertEqual(converted.read(), fp.read())
+
+    def test_read(self):
+        self.assertEqual(helpers.read_log_file_lines(), self.lines)
+        self.assertEqual(helpers.read_log_file_lines('2015-01-02', '2015-01-02'), self.lines[5:])
+        self.assertEqual(helpers.read_last_entry(), self.lines[-1])
+
+    def test_write(self):
+        with mock.patch('timeflow.helpers.dt', FakeDateTime):
+            FakeDateTime.now = classmethod(lambda cls: datetime.datetime(2015, 1, 3, 9, 0))
+            helpers.write_to_log_file('Arrived.')
+            helpers.write_to_log_file('Work: task #1')
+
+        self.assertEqual(helpers.read_log_file_lines('2015-01-03', '2015-01-03'),
+                         ['2015-01-03 09:00 Arrived.\n', '2015-01-03 09:00 Work: task #1\n'])
+        self.assertEqual(len(storage.get_storage().load_log()), 13)
+
+    def test_calculate(self):
+        for report in (True, False):
+            work_time, slack_time, today_time, work_dict, slack_dict = calculate_log_stats(
+                '2015-01-01', '2015-01-02', today=True, report=report)
+            expected = log_parser.calculate(self.lines, '2015-01-01', '2015-01-02', today=True, report=report)
+            self.assertEqual((sum(work_time), sum(slack_time), today_time, work_dict, slack_dict),
+                             (sum(expected[0]), sum(expected[1])) + expected[2:])
+
+
+class TestImporter(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = os.path.dirname(os.path.realpath(__file__))
+        self.real_log_file = helpers.LOG_FILE
+        self.tmp_dir = tempfile.mkdtemp()
+        self.environ = mock.patch.dict('os.environ', {'XDG_CACHE_HOME': self.tmp_dir + '/cache'})
+        self.environ.start()
+        helpers.LOG_FILE = self.tmp_dir + '/timelog.txt'
+        shutil.copy(self.test_dir + '/fake_log.txt', helpers.LOG_FILE)
+        log_index.rebuild_index(helpers.LOG_FILE)
+
+    def tearDown(self):
+        self.environ.stop()
+        helpers.LOG_FILE = self.real_log_file
+        shutil.rmtree(self.tmp_dir)
+
+    def import_text(self, name, text, format=None):
+        with open(self.tmp_dir + '/' + name, 'w') as fp:
+            fp.write(text)
+        return importer.import_file(self.tmp_dir + '/' + name, format=format)
+
+    def test_merge(self):
+        count = self.import_text('export.csv', 'date,time,message\n'
+                                               '2015-01-02,07:00,Arrived early.\n'
+                                               '2015-01-01,20:00,Timeflow: late task\n'
+                                               '2014-12-31,08:00:00,Arrived.\n')
+        self.assertEqual(count, 3)
+        lines = helpers.read_log_file_lines()
+        self.assertEqual(lines, sorted(lines))
+        self.assertEqual(lines[0], '2014-12-31 08:00 Arrived.\n')
+        self.assertIn('2015-01-01 20:00 Timeflow: late task\n', lines)
+        with open(helpers.LOG_FILE) as fp:
+            self.assertIn('2014-12-31 08:00 Arrived.\n\n2015-01-01', fp.read())
+        self.assertEqual(log_index.load_index(helpers.LOG_FILE), log_index.build_index(helpers.LOG_FILE))
+
+    def test_append(self):
+        with open(helpers.LOG_FILE) as fp:
+            text = fp.read()
+        self.import_text('export.json', '{"datetime": "2015-01-03T09:00", "message": "Work: b"}\n'
+                                        '{"datetime": "2015-01-03 08:00", "message": "Arrived."}\n')
+        with open(helpers.LOG_FILE) as fp:
+            self.assertEqual(fp.read(), text + '\n2015-01-03 08:00 Arrived.\n2015-01-03 09:00 Work: b\n')
+
+        self.import_text('export.txt', '2015-01-03 10:00: Work: c **\n', format='gtimelog')
+        self.assertEqual(helpers.read_last_entry(), '2015-01-03 10:00 Work: c **\n')
+
+    @unittest.skipIf(storage.fcntl is None, "advisory locks are not supported")
+    def test_log_while_merging(self):
+        writers = []
+        rebuild_index = log_index.rebuild_index
+
+        def log_and_rebuild_index(log_file):
+            # `tf log` started after log file was replaced by import still waits for it
+            writer = threading.Thread(target=helpers.write_messages, args=(['2015-01-03 09:00 Work: logged'],))
+            writer.start()
+            writer.join(0.2)
+            self.assertTrue(writer.is_alive())
+            writers.append(writer)
+            rebuild_index(log_file)
+
+        with mock.patch('timeflow.log_index.rebuild_index', log_and_rebuild_index):
+            self.import_text('export.csv', 'date,time,message\n2014-12-31,08:00,Arrived.\n')
+        writers[0].join()
+        lines = helpers.read_log_file_lines()
+        self.assertEqual(lines[0], '2014-12-31 08:00 Arrived.\n')
+        self.assertEqual(lines[-1], '2015-01-03 09:00 Work: logged\n')
+        self.assertEqual(log_index.load_index(helpers.LOG_FILE), log_index.build_index(helpers.LOG_FILE))
+
+    def test_formats(self):
+        for format in importer.FORMATS:
+            self.assertEqual(parse_args(['import', '-', '-f', format]).format, format)
+
+    def test_invalid(self):
+        for text in ('2015-02-30 08:00: Arrived.\n', '2015-01-01 25:00: Arrived.\n',
+                     '2015-01-01 08:00:\n', 'Arrived.\n'):
+            with self.assertRaises(SystemExit):
+                self.import_text('export.txt', text)
+        with open(self.test_dir + '/fake_log.txt') as fp, open(helpers.LOG_FILE) as log:
+            self.assertEqual(log.read(), fp.read())
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = os.path.dirname(os.path.realpath(__file__))
+        self.real_log_file = helpers.LOG_FILE
+        helpers.LOG_FILE = self.test_dir + '/fake_log.txt'
+
+        self.cache_home = tempfile.mkdtemp()
+        self.environ = mock.patch.dict('os.environ', {'XDG_CACHE_HOME': self.cache_home})
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.cache_home)
+        helpers.LOG_FILE = self.real_log_file
+
+    def export(self, format, date_from='2015-01-01', date_to='2015-01-02'):
+        with mock.patch('timeflow.arg_parser.sys.stdout', StringIO()) as stdout:
+            args = parse_args(['stats', '--from', date_from, '--to', date_to, '--format', format])
+            args.func(args)
+        return stdout.getvalue()
+
+    def test_records(self):
+        records = list(export.iter_records('2015-01-01', '2015-01-02'))
+        self.assertEqual(records[0], ('2015-01-01', 'work', 'Timeflow', 'start project', 4500))
+        self.assertEqual(sorted(set(record[0] for record in records)), ['2015-01-01', '2015-01-02'])
+
+        work_time, slack_time, _, work_dict, slack_dict = log_parser.calculate(
+            helpers.read_log_file_lines(), '2015-01-01', '2015-01-02')
+        for kind, total, report_dict in (('work', work_time, work_dict), ('slack', slack_time, slack_dict)):
+            self.assertEqual(sum(record[4] for record in records if record[1] == kind), sum(total))
+            for project, logs in report_dict.items():
+                for log_message, seconds in logs.items():
+                    self.assertEqual(sum(record[4] for record in records
+                                         if record[1:4] == (kind, project, log_message)), seconds)
+
+    def test_log_files_of_same_date(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            with open(tmp_dir + '/a.txt', 'w') as fp:
+                fp.write('2015-01-01 08:00 Arrived.\n2015-01-01 09:00 Project: a\n')
+            with open(tmp_dir + '/b.txt', 'w') as fp:
+                fp.write('2015-01-01 07:00 Arrived.\n2015-01-01 07:30 Project: b\n')
+            records = list(export.iter_records('2015-01-01', '2015-01-01', [tmp_dir + '/*.txt']))
+        finally:
+            shutil.rmtree(tmp_dir)
+        # the last entry of a.txt isn't paired with the first entry of b.txt
+        self.assertEqual(records, [
+            ('2015-01-01', 'work', 'Project', 'a', 3600),
+            ('2015-01-01', 'work', 'Project', 'b', 1800),
+        ])
+
+    def test_period_stats_of_log_files(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            with open(tmp_dir + '/a.txt', 'w') as fp:
+                fp.write('2015-01-01 08:00 Arrived.\n2015-01-01 09:00 Project: a\n')
+            with open(tmp_dir + '/b.txt', 'w') as fp:
+                fp.write('2015-01-01 07:00 Arrived.\n2015-01-01 07:30 Project: b\n'
+                         '2015-01-02 07:00 Arrived.\n2015-01-02 07:15 Project: b\n')
+            periods = calculate_period_stats('2015-01-01', '2015-01-02', 'day',
+                                             log_files=[tmp_dir + '/*.txt'])
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEqual(list(periods), ['2015-01-01', '2015-01-02'])
+        work_time, slack_time, work_dict, slack_dict = periods['2015-01-01']
+        self.assertEqual(sum(work_time), 5400)
+        self.assertEqual(work_dict, {'Project': {'a': 3600, 'b': 1800}})
+        self.assertEqual(sum(periods['2015-01-02'][0]), 900)
+
+    def test_formats(self):
+        records = [dict(zip(export.FIELDS, record)) for record in export.iter_records('2015-01-01', '2015-01-02')]
+        self.assertEqual(json.loads(self.export('json')), records)
+        self.assertEqual([json.loads(line) for line in self.export('ndjson').splitlines()], records)
+
+        lines = self.export('csv').splitlines()
+        self.assertEqual(lines[0], 'date,kind,project,log,seconds')
+        self.assertEqual(lines[1], '2015-01-01,work,Timeflow,start project,4500')
+        self.assertEqual(len(lines), len(records) + 1)
+
+        self.assertEqual(json.loads(self.export('json', '2015-01-03', '2015-01-03')), [])
+
+    def test_by(self):
+        lines = self.export('csv', date_to='2015-01-31').splitlines()
+        self.assertEqual(lines[0], 'date,kind,project,log,seconds')
+        with mock.patch('timeflow.arg_parser.sys.stdout', StringIO()) as stdout:
+            args = parse_args(['stats', '--from', '2015-01-01', '--to', '2015-01-31', '--by', 'week', '--format', 'csv'])
+            args.func(args)
+        weeks = stdout.getvalue().splitlines()
+        self.assertEqual(weeks[0], 'week,kind,project,log,seconds')
+        self.assertEqual(set(line.split(',')[0] for line in weeks[1:]), set(['2015-W01']))
+        self.assertEqual(sum(int(line.split(',')[-1]) for line in weeks[1:]),
+                         sum(int(line.split(',')[-1]) for line in lines[1:]))
+
+    def test_print_periods(self):
+        with mock.patch('sys.stdout', StringIO()) as stdout:
+            args = parse_args(['stats', '--from', '2015-01-01', '--to', '2015-01-02', '--by', 'day', '-r'])
+            args.func(args)
+        self.assertEqual(stdout.getvalue().splitlines()[:3], [
+            '2015-01-01  Work: 02h 50m  Slack: 01h 10m',
+            '    Django: 1h 35m',
+            '    Timeflow: 1h 15m',
+        ])
+        self.assertEqual(stdout.getvalue().splitlines()[-1], 'Total       Work: 06h 00m  Slack: 02h 40m')
+
+
+class TestWatch(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = os.path.dirname(os.path.realpath(__file__))
+        self.real_log_file = helpers.LOG_FILE
+        self.tmp_dir = tempfile.mkdtemp()
+        helpers.LOG_FILE = self.tmp_dir + '/timelog.txt'
+        with open(self.test_dir + '/fake_log.txt') as fp:
+            self.text = fp.read()
+        self.day_2 = self.text.split('\n\n')[1]
+
+    def tearDown(self):
+        helpers.LOG_FILE = self.real_log_file
+        shutil.rmtree(self.tmp_dir)
+
+    def assert_stats(self, stats):
+        lines = helpers.read_log_file_lines()
+        work_time, slack_time, _, work_dict, slack_dict = log_parser.calculate(lines, stats.date, stats.date)
+        self.assertEqual((stats.work_time, stats.slack_time, stats.work_dict, stats.slack_dict),
+                         (sum(work_time), sum(slack_time), work_dict, slack_dict))
+
+    def test_follow(self):
+        with open(helpers.LOG_FILE, 'w') as fp:
+            fp.write(self.text[:self.text.index(self.day_2) + 60])
+        log_index.rebuild_index(helpers.LOG_FILE)
+        stats = watch.get_today_stats(date='2015-01-02')
+        self.assertTrue(stats.poll())
+        # reading starts at the first entry of the day
+        self.assertEqual(stats.offset, os.path.getsize(helpers.LOG_FILE))
+        self.assertEqual(stats.first_line.time, '08:25')
+        self.assertFalse(stats.poll())
+
+        with open(helpers.LOG_FILE, 'a') as fp:
+            fp.write(self.text[self.text.index(self.day_2) + 60:])
+        self.assertTrue(stats.poll())
+        self.assert_stats(stats)
+
+        # replaced log file is read again
+        stats.poll()
+        with open(helpers.LOG_FILE + '.new', 'w') as fp:
+            fp.write(self.text + '2015-01-02 14:00 Work: new task\n')
+        os.rename(helpers.LOG_FILE + '.new', helpers.LOG_FILE)
+        self.assertTrue(stats.poll())
+        self.assert_stats(stats)
+
+    def test_partial_line(self):
+        with open(helpers.LOG_FILE, 'w') as fp:
+            fp.write('2015-01-02 08:00 Arrived.\n2015-01-02 09:00 Work: ta')
+        stats = watch.get_today_stats(date='2015-01-02')
+        stats.poll()
+        self.assertEqual(stats.work_time, 0)
+        with open(helpers.LOG_FILE, 'a') as fp:
+            fp.write('sk\n')
+        stats.poll()
+        self.assertEqual(dict(stats.work_dict), {'Work': {'task': 3600}})
+
+    def test_storage(self):
+        helpers.LOG_FILE = self.tmp_dir + '/timelog.sqlite'
+        storage.convert(self.test_dir + '/fake_log.txt', helpers.LOG_FILE)
+        stats = watch.get_today_stats(date='2015-01-02')
+        self.assertTrue(stats.poll())
+        self.assert_stats(stats)
+        self.assertFalse(stats.poll())
+
+    def test_render(self):
+        with open(helpers.LOG_FILE, 'w') as fp:
+            fp.write(self.text)
+        stats = watch.get_today_stats(date='2015-01-02')
+        stats.poll()
+        with mock.patch('sys.stdout', StringIO()) as stdout:
+            watch.render(stats, report=True)
+        self.assertTrue(stdout.getvalue().startswith(watch.CLEAR_SCREEN))
+        self.assertIn(' WORK 3h 10m ', stdout.getvalue())
+
+
+class TestMultiLog(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = os.path.dirname(os.path.realpath(__file__))
+        with open(self.test_dir + '/fake_log.txt') as fp:
+            day_1, day_2 = fp.read().split('\n\n')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.environ = mock.patch.dict('os.environ', {'XDG_CACHE_HOME': self.tmp_dir + '/cache'})
+        self.environ.start()
+
+        # log rotated into a compressed file, another log without an index and an old one
+        with gzip.open(self.tmp_dir + '/timelog-2015-01-01.txt.gz', 'wb') as fp:
+            fp.write((day_1 + '\n').encode('utf-8'))
+        with open(self.tmp_dir + '/timelog.txt', 'w') as fp:
+            fp.write(day_2)
+        log_index.rebuild_index(self.tmp_dir + '/timelog.txt')
+        with open(self.tmp_dir + '/timelog-2014.txt', 'w') as fp:
+            fp.write('2014-12-31 08:00 Arrived.\n2014-12-31 09:00 Work: task\n')
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_prune(self):
+        paths = multilog.expand_paths([self.tmp_dir + '/timelog*'])
+        self.assertEqual(len(paths), 3)
+        self.assertEqual(multilog.file_bounds(paths)[self.tmp_dir + '/timelog-2015-01-01.txt.gz'],
+                         ('2015-01-01', '2015-01-01'))
+        self.assertEqual(multilog.prune(paths, '2015-01-02', '2015-01-31'), [self.tmp_dir + '/timelog.txt'])
+
+    def test_calculate_files(self):
+        lines = list(multilog.iter_lines(self.test_dir + '/fake_log.txt'))
+        work_time, slack_time, _, work_dict, slack_dict = log_parser.calculate(lines, '2015-01-01', '2015-01-31')
+
+        for jobs in (1, 2):
+            result = multilog.calculate_files(
+                [self.tmp_dir + '/timelog*'], '2015-01-01', '2015-01-31', jobs=jobs)
+            self.assertEqual(result[0], [170 * 60, 190 * 60])
+            self.assertEqual(sum(result[1]), sum(slack_time))
+            self.assertEqual(result[3:], (work_dict, slack_dict))
+
+    def test_calculate_chunks(self):
+        log_file = self.tmp_dir + '/fake_log.txt'
+        shutil.copy(self.test_dir + '/fake_log.txt', log_file)
+        self.assertEqual(multilog.calculate_chunks('2015-01-01', '2015-01-02', log_file=log_file), None)
+
+        log_index.rebuild_index(log_file)
+        index = log_index.load_index(log_file)
+        chunks = multilog.split_chunks(index, '2015-01-01', '2015-01-02', 4)
+        # chunks are split at day boundaries only
+        self.assertEqual(chunks, [(20, index['dates'][1][1]), (index['dates'][1][1], index['size'])])
+
+        lines = list(multilog.iter_lines(log_file))
+        expected = log_parser.calculate(lines, '2015-01-01', '2015-01-02')
+        result = multilog.calculate_chunks('2015-01-01', '2015-01-02', jobs=2, log_file=log_file)
+        self.assertEqual(result[0], [170 * 60, 190 * 60])
+        self.assertEqual(sum(result[1]), sum(expected[1]))
+        self.assertEqual(result[3:], expected[3:])
+
+    def test_stats(self):
+        sys.stdout = StringIO()
+        args = parse_args([
+            'stats', '--from', '2014-12-01', '--to', '2015-01-31',
+            '-l', self.tmp_dir + '/timelog.txt',
+            '-l', self.tmp_dir + '/*.gz',
+            '-l', self.tmp_dir + '/timelog-2014.txt',
+        ])
+        args.func(args)
+        self.assertEqual(sys.stdout.getvalue().strip(), "Work: 07h 00m\nSlack: 02h 40m")
+
+
+@unittest.skipUnless(client.is_supported(), "Unix sockets are not supported")
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = os.path.dirname(os.path.realpath(__file__))
+        self.real_log_file = helpers.LOG_FILE
+        helpers.LOG_FILE = self.test_dir + '/auto_fake_log.txt'
+        with open(self.test_dir + '/fake_log.txt') as src:
+            with open(helpers.LOG_FILE, 'w') as dst:
+                dst.write(src.read())
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.environ = mock.patch.dict('os.environ', {
+            'XDG_CACHE_HOME': self.temp_dir,
+            'XDG_RUNTIME_DIR': self.temp_dir,
+        })
+        self.environ.start()
+
+        self.server = daemon.Server(client.socket_path(), daemon.RequestHandler)
+        self.server.log_state = daemon.LogState(helpers.LOG_FILE)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.environ.stop()
+        shutil.rmtree(self.temp_dir)
+        for path in (helpers.LOG_FILE, log_index.index_path(helpers.LOG_FILE), storage.lock_path(helpers.LOG_FILE)):
+            if os.path.exists(path):
+                os.remove(path)
+        helpers.LOG_FILE = self.real_log_file
+
+    def assert_stats(self, date_from, date_to):
+        work_time, slack_time, _, work_report, slack_report = calculate_log_stats(date_from, date_to)
+        self.assertEqual(
+            client.calculate(date_from, date_to),
+            ([sum(work_time)], [sum(slack_time)], None, work_report, slack_report))
+
+    def test_stats(self):
+        self.assert_stats('2015-01-01', '2015-01-02')
+        self.assert_stats('2015-01-02', '2015-01-02')
+        self.assert_stats('2015-01-03', '2015-01-05')
+
+    def test_log(self):
+        self.assertTrue(client.write_to_log_file('Work: logged by daemon'))
+        self.assertEqual(helpers.read_last_entry()[helpers.DATETIME_LEN+1:], 'Work: logged by daemon\n')
+        today = datetime.datetime.now().strftime(helpers.DATE_FORMAT)
+        self.assert_stats(today, today)
+
+    def test_log_unparseable(self):
+        with open(helpers.LOG_FILE, 'a') as fp:
+            fp.write('2015-01-03 xx:yy Work: invalid\n')
+        self.assertTrue(client.write_to_log_file('Work: logged once'))
+        with open(helpers.LOG_FILE) as fp:
+            self.assertEqual(fp.read().count('Work: logged once'), 1)
+        # stats request fails, so client calculates them itself
+        self.assertEqual(client.calculate('2015-01-01', '2015-01-02'), None)
+
+        helpers.LOG_FILE = self.temp_dir + '/invalid.txt'
+        with open(helpers.LOG_FILE, 'w') as fp:
+            fp.write('2015-01-03 xx:yy Work: invalid\n')
+        with self.assertRaises(SystemExit):
+            daemon.serve()
+        helpers.LOG_FILE = self.test_dir + '/auto_fake_log.txt'
+
+    def test_socket_of_other_user(self):
+        other_user = mock.Mock(st_uid=os.getuid() + 1)
+        with mock.patch('timeflow.client.os.lstat', return_value=other_user):
+            self.assertEqual(client.calculate('2015-01-01', '2015-01-02'), None)
+            with self.assertRaises(SystemExit):
+                daemon.serve()
+
+    def test_runtime_dir(self):
+        with mock.patch.dict('os.environ', {'XDG_RUNTIME_DIR': ''}):
+            with mock.patch('tempfile.gettempdir', return_value=self.temp_dir):
+                path = client.runtime_dir()
+                self.assertEqual(os.path.dirname(path), self.temp_dir)
+                daemon._make_runtime_dir()
+                self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+
+                os.chmod(path, 0o777)
+                with self.assertRaises(SystemExit):
+                    daemon._make_runtime_dir()
+
+    def test_not_running(self):
+        helpers.LOG_FILE = self.test_dir + '/fake_log.txt'
+        self.assertEqual(client.calculate('2015-01-01', '2015-01-02'), None)
+        helpers.LOG_FILE = self.test_dir + '/auto_fake_log.txt'
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,3 +1,23 @@
-from pkg_resources import get_distribution
+import sys
 
-__version__ = get_distribution("timeflow").version
+
+def get_version():
+    "Returns installed timeflow's version"
+    try:
+        from importlib.metadata import version
+    except ImportError:
+        # importlib.metadata is available since python 3.8
+        from pkg_resources import get_distribution
+        return get_distribution("timeflow").version
+    return version("timeflow")
+
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        # version is resolved lazily, as it's slow and only needed for `-v`
+        if name == '__version__':
+            return get_version()
+        raise AttributeError("module 'timeflow' has no attribute '{}'".format(name))
+else:
+    # module __getattr__ is supported since python 3.7, version is resolved on import before it
+    __version__ = get_version()
@@ -1,41 +1,85 @@
 import argparse
+from collections import OrderedDict
 from datetime import datetime as dt
 from datetime import timedelta
 import os
 import subprocess
+import sys
 
-from timeflow import __version__
+from timeflow import get_version
+from timeflow import profiling
+from timeflow import storage
 from timeflow.helpers import (
-    DATE_FORMAT, LOG_FILE,
+    DATE_FORMAT, LOG_FILE, POLL_INTERVAL,
     get_last_month,
     get_last_week,
     get_month_range,
     get_week_range,
-    read_log_file_lines,
+    log_file_stat,
+    rebuild_log_index,
+    print_periods,
     print_stats,
     print_report,
+    write_messages,
     write_to_log_file,
     print_today_work_time)
 
-from timeflow.log_parser import (
-    calculate_report,
-    calculate_stats,
-)
-
 
 def log(args):
-    write_to_log_file(' '.join(args.message))
+    if args.stdin:
+        # batch is written directly, with a single lock and append
+        write_messages([line.rstrip('\r\n') for line in sys.stdin if line.strip()])
+        return
+
+    # only the daemon client is imported, to keep startup fast
+    from timeflow import client
+
+    message = ' '.join(args.message)
+    if not client.write_to_log_file(message):
+        write_to_log_file(message)
 
 
 def edit(args):
+    if not storage.get_storage(LOG_FILE).is_text:
+        edit_as_text(args)
+        return
+
+    log_stat = log_file_stat()
+    _run_editor(args, LOG_FILE)
+    # log file was changed, so its index and day summaries are out of date
+    if log_file_stat() != log_stat:
+        from timeflow import summaries
+
+        rebuild_log_index()
+        summaries.revalidate(LOG_FILE)
+
+
+def edit_as_text(args):
+    "Edits binary or SQLite log file as text, converting it back if it was changed"
+    import tempfile
+
+    fd, text_file = tempfile.mkstemp(prefix='timelog-', suffix='.txt')
+    os.close(fd)
+    try:
+        storage.convert(LOG_FILE, text_file)
+        text_stat = os.stat(text_file)
+        _run_editor(args, text_file)
+        stat = os.stat(text_file)
+        if (stat.st_size, stat.st_mtime) != (text_stat.st_size, text_stat.st_mtime):
+            storage.convert(text_file, LOG_FILE)
+    finally:
+        os.remove(text_file)
+
+
+def _run_editor(args, log_file):
     if args.editor:
-        subprocess.call([args.editor, LOG_FILE])
+        subprocess.call([args.editor, log_file])
     else:
         editor = os.environ.get('EDITOR')
         if editor in ('vi', 'vim'):  # open the file with the cursor on the last line of the file
-            subprocess.call([editor, '+', LOG_FILE])
+            subprocess.call([editor, '+', log_file])
         elif editor:
-            subprocess.call([editor, LOG_FILE])
+            subprocess.call([editor, log_file])
         else:
             subprocess.call([
                 "echo",
@@ -46,6 +90,11 @@ def edit(args):
 
 
 def stats(args):
+    if args.watch:
+        from timeflow import watch
+        watch.watch(args.interval, report=args.report, colorize=args.color)
+        return
+
     today = False
     if args.yesterday:
         yesterday_obj = dt.now() - timedelta(days=1)
@@ -71,21 +120,123 @@ def stats(args):
         date_from = date_to = dt.now().strftime(DATE_FORMAT)
         today = True
 
-    lines = read_log_file_lines()
-    work_time, slack_time, today_work_time = calculate_stats(lines, date_from, date_to, today=today)
-    if args.report:
-        work_report, slack_report = calculate_report(lines, date_from, date_to)
+    if args.format != 'text':
+        with profiling.phase('import'):
+            from timeflow import export
+        export.write_stats(sys.stdout, args.format, date_from, date_to,
+                           log_files=args.log_files, by=args.by or 'day')
+        return
 
-        print_report(work_report, slack_report, work_time, slack_time, colorize=args.color)
-        print_today_work_time(today_work_time)
+    if args.by:
+        period_stats = calculate_period_stats(date_from, date_to, args.by,
+                                              report=args.report, log_files=args.log_files)
+        with profiling.phase('rendering'):
+            print_periods(period_stats, report=args.report, colorize=args.color)
+        return
+
+    if args.log_files:
+        with profiling.phase('import'):
+            from timeflow.multilog import calculate_files
+        result = calculate_files(args.log_files, date_from, date_to,
+                                 today=today, report=args.report, jobs=args.jobs)
     else:
-        print_stats(work_time, slack_time, today_work_time)
+        with profiling.phase('import'):
+            from timeflow import client
+        result = client.calculate(date_from, date_to, today=today, report=args.report)
+        if result is None:
+            result = calculate_log_stats(date_from, date_to, today=today, report=args.report, jobs=args.jobs)
+    work_time, slack_time, today_work_time, work_report, slack_report = result
+
+    with profiling.phase('rendering'):
+        if args.report:
+            print_report(work_report, slack_report, work_time, slack_time, colorize=args.color)
+        else:
+            print_stats(work_time, slack_time, today_work_time)
         print_today_work_time(today_work_time)
 
 
+def calculate_log_stats(date_from, date_to, today=False, report=True, jobs=None):
+    """Reads log file and calculates its stats, see log_parser.calculate
+
+    If jobs are given, or cache is disabled and date range is large, log
+    file is parsed in chunks by jobs processes.
+    """
+    # stats modules are imported on demand, to keep `tf log` startup fast
+    with profiling.phase('import'):
+        from timeflow import cache, helpers, summaries
+        from timeflow.log_parser import ParsedLog, calculate
+        from timeflow.multilog import calculate_chunks
+
+    # binary and SQLite log files calculate their stats themselves
+    result = storage.get_storage(helpers.LOG_FILE).calculate(date_from, date_to, today=today, report=report)
+    if result is not None:
+        return result
+
+    if jobs != 1 and (jobs is not None or not cache.is_enabled()):
+        result = calculate_chunks(date_from, date_to, today=today, report=report, jobs=jobs)
+        if result is not None:
+            return result
+    if cache.is_enabled():
+        with profiling.phase('aggregation'):
+            result = summaries.calculate(date_from, date_to, today=today, report=report)
+        if result is not None:
+            return result
+        log = cache.load_log()
+    else:
+        log = ParsedLog(date_from=date_from, date_to=date_to)
+    return calculate(log, date_from, date_to, today=today, report=report)
+
+
+def calculate_period_stats(date_from, date_to, by, report=True, log_files=None):
+    """Reads log files and calculates stats of each period of date range
+
+    Lines of date range are parsed and grouped by period in a single walk,
+    see log_parser.calculate_periods. Each of log files is calculated on
+    its own, and stats of the same period of all files are merged.
+    """
+    with profiling.phase('import'):
+        from timeflow import helpers
+        from timeflow.export import get_paths, iter_lines
+        from timeflow.log_parser import ParsedLog, calculate_periods, merge_period
+
+    log_storage = storage.get_storage(helpers.LOG_FILE)
+    if log_files:
+        stats = {}
+        for path in get_paths(date_from, date_to, log_files):
+            with profiling.phase('read'):
+                log = ParsedLog(list(iter_lines(path, date_from, date_to)))
+            for period, period_stats in calculate_periods(log, date_from, date_to, by=by, report=report).items():
+                merge_period(stats, period, *period_stats)
+        return OrderedDict(sorted(stats.items()))
+    elif not log_storage.is_text:
+        with profiling.phase('read'):
+            log = log_storage.load_log()
+    else:
+        log = ParsedLog(date_from=date_from, date_to=date_to)
+    return calculate_periods(log, date_from, date_to, by=by, report=report)
+
+
+def serve(args):
+    from timeflow import daemon
+    daemon.serve(poll_interval=args.poll_interval)
+
+
+def convert(args):
+    storage.convert(args.source, args.destination)
+
+
+def import_log(args):
+    from timeflow import importer
+    count = importer.import_file(args.file, format=args.format)
+    print('Imported {} entries'.format(count))
+
+
 def set_log_parser(subparser):
     log_parser = subparser.add_parser("log", help="Create timelog message")
     log_parser.add_argument("message", nargs='*', default="", help="message that will be logged")
+    log_parser.add_argument("--stdin", action="store_true",
+                            help="log messages read from standard input, one per line, "
+                                 "lines starting with date and time are logged as they are")
     # call log() function, when processing log command
     log_parser.set_defaults(func=log)
 
@@ -97,6 +248,34 @@ def set_edit_parser(subparser):
     edit_parser.set_defaults(func=edit)
 
 
+def set_serve_parser(subparser):
+    serve_parser = subparser.add_parser("serve", help="Run daemon keeping parsed log in memory for fast stats")
+    serve_parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL,
+                              help="Seconds between checks of log file for changes")
+    # call serve() function, when processing serve command
+    serve_parser.set_defaults(func=serve)
+
+
+def set_convert_parser(subparser):
+    convert_parser = subparser.add_parser(
+        "convert", help="Convert log file between text, binary and SQLite formats, by their extensions")
+    convert_parser.add_argument("source", help="log file to convert")
+    convert_parser.add_argument("destination", help="converted log file, binary if it ends with .tfb, SQLite if it ends with .sqlite or .db")
+    # call convert() function, when processing convert command
+    convert_parser.set_defaults(func=convert)
+
+
+def set_import_parser(subparser):
+    import_parser = subparser.add_parser(
+        "import", help="Import entries exported from other time loggers in chronological order")
+    import_parser.add_argument("file", help="file to import, - reads standard input")
+    # same as importer.FORMATS, which isn't imported to keep `tf log` startup fast
+    import_parser.add_argument("-f", "--format", choices=('csv', 'json', 'gtimelog'),
+                               help="format of file, guessed by its extension (.csv, .json), gtimelog otherwise")
+    # call import_log() function, when processing import command
+    import_parser.set_defaults(func=import_log)
+
+
 def set_stats_parser(subparser):
     stats_parser = subparser.add_parser("stats", help="Show how much time was spent working or slacking")
 
@@ -116,21 +295,59 @@ def set_stats_parser(subparser):
     stats_parser.add_argument("-r", "--report", action="store_true", help="Show stats in report form")
     stats_parser.add_argument("-c", "--color", action="store_true", help="Colorize stats report")
 
+    stats_parser.add_argument("-l", "--log-file", action="append", dest="log_files", metavar="PATH",
+                              help="Calculate stats of log files matching PATH instead of the default log "
+                                   "file, can be a glob and be given several times, .gz files are supported")
+    stats_parser.add_argument("-j", "--jobs", type=int,
+                              help="Number of processes parsing log files or chunks of log file (default: number of CPUs)")
+
+    stats_parser.add_argument("--by", choices=('day', 'week', 'month'),
+                              help="Show work times of each day, ISO week or month of date range")
+    stats_parser.add_argument("--format", choices=('text', 'json', 'csv', 'ndjson'), default='text',
+                              help="Write work and slack time of each project and log of each day "
+                                   "in machine-readable format, streamed day by day (default: text)")
+
+    stats_parser.add_argument("--watch", action="store_true",
+                              help="Keep showing today's work times, following new log entries")
+    stats_parser.add_argument("--interval", type=float, default=5, metavar="SECONDS",
+                              help="Seconds between redraws of --watch (default: 5)")
+
     # call stats() function, when processing stats command
     stats_parser.set_defaults(func=stats)
 
 
+class VersionAction(argparse.Action):
+    "Prints timeflow's version, which is resolved only when it's asked for"
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+        super(VersionAction, self).__init__(
+            option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        parser.exit(message="timeflow {}\n".format(get_version()))
+
+
 def parse_args(args):
     parser = argparse.ArgumentParser()
 
     parser.add_argument("-v", "--version",
                         help="Show timeflow's version",
-                        action="version",
-                        version="timeflow {}".format(__version__))
+                        action=VersionAction)
+    parser.add_argument("--profile",
+                        help="Print time spent in each phase to stderr (or set TIMEFLOW_PROFILE=1)",
+                        action="store_true",
+                        default=profiling.env_enabled())
+    parser.add_argument("--profile-output",
+                        metavar="FILE",
+                        help="Dump cProfile stats to FILE (or set TIMEFLOW_PROFILE_OUTPUT)",
+                        default=profiling.env_output())
 
     subparser = parser.add_subparsers(help="sub-command help")
     set_log_parser(subparser)
     set_edit_parser(subparser)
     set_stats_parser(subparser)
+    set_serve_parser(subparser)
+    set_convert_parser(subparser)
+    set_import_parser(subparser)
 
     return parser.parse_args(args)
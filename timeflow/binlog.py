@@ -0,0 +1,273 @@
+"""Compact binary log file format
+
+Binary log file (ending with .tfb) keeps each line of text log file as
+a fixed-width record of minutes since epoch, flags and ids of project, log
+and text strings. Strings are stored once each in a string table file next
+to it (.tfb.str). Records are read from memory-mapped file, so stats are
+calculated without parsing dates and messages. Records of a large file are
+viewed as a NumPy structured array over the mapping, if NumPy is installed,
+otherwise they are unpacked one by one.
+
+Text of every line, including comments and blank lines, is kept too, so log
+file is converted to text and back without losing anything, see storage
+module.
+"""
+from array import array
+import mmap
+import os
+import struct
+
+from timeflow import columnar
+from timeflow import helpers
+from timeflow.columnar import ColumnarLog, minutes_to_date, minutes_to_time
+from timeflow.log_parser import MINUTES_IN_DAY, date_to_minutes, parse_entry
+
+
+MAGIC = b'TFB\x01'
+# minute, flags, project id, log id, text id
+RECORD = struct.Struct('<iBiii')
+# NumPy structured dtype of RECORD, packed without padding the same way
+RECORD_FIELDS = [('minute', '<i4'), ('flags', 'u1'), ('project_id', '<i4'), ('log_id', '<i4'), ('text_id', '<i4')]
+STRING_LENGTH = struct.Struct('<I')
+STRINGS_SUFFIX = '.str'
+
+# record flags
+SLACK = 1
+ENTRY = 2
+# text is the whole line, not only the part after entry's date and time
+FULL_TEXT = 4
+
+
+def strings_path(path):
+    return path + STRINGS_SUFFIX
+
+
+class StringTable():
+    "Strings of binary log file, interning new ones to be appended to it"
+
+    def __init__(self, strings=None):
+        self.strings = strings or []
+        self.ids = dict((string, i) for i, string in enumerate(self.strings))
+        self.new = []
+
+    def intern(self, string):
+        try:
+            return self.ids[string]
+        except KeyError:
+            self.ids[string] = len(self.strings)
+            self.strings.append(string)
+            self.new.append(string)
+            return self.ids[string]
+
+    def pack_new(self):
+        "Returns bytes of strings interned since the table was read"
+        data = []
+        for string in self.new:
+            encoded = string.encode('utf-8')
+            data.append(STRING_LENGTH.pack(len(encoded)))
+            data.append(encoded)
+        return b''.join(data)
+
+
+def read_strings(path):
+    "Returns string table of binary log file"
+    try:
+        with open(strings_path(path), 'rb') as fp:
+            data = fp.read()
+    except IOError:
+        return []
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('{} is not a timeflow binary log file'.format(path))
+
+    strings = []
+    pos = len(MAGIC)
+    while pos + STRING_LENGTH.size <= len(data):
+        length, = STRING_LENGTH.unpack_from(data, pos)
+        pos += STRING_LENGTH.size
+        strings.append(data[pos:pos+length].decode('utf-8'))
+        pos += length
+    return strings
+
+
+def iter_records(path):
+    "Yields (minute, flags, project_id, log_id, text_id) records of binary log file"
+    try:
+        fp = open(path, 'rb')
+    except IOError:
+        return
+
+    with fp:
+        try:
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file can't be mapped
+            return
+
+        # record cut short by an interrupted write is ignored
+        end = len(mm) - len(mm) % RECORD.size
+        records = RECORD.iter_unpack(mm if end == len(mm) else mm[:end])
+        try:
+            for record in records:
+                yield record
+        finally:
+            # mapping can't be closed while records iterator holds its buffer
+            del records
+            mm.close()
+
+
+def make_record(line, table):
+    "Returns record of text log file line, interning its strings into table"
+    parsed = parse_entry(line)
+    if parsed is None:
+        return (0, FULL_TEXT, -1, -1, table.intern(line))
+
+    flags = ENTRY | (SLACK if parsed.is_slack else 0)
+    text = line[helpers.DATETIME_LEN+1:]
+    if format_entry(parsed.minute, text) != line:
+        # e.g. extra spaces after date, line is restored as it was
+        flags |= FULL_TEXT
+        text = line
+    return (parsed.minute, flags, table.intern(parsed.project),
+            table.intern(parsed.log), table.intern(text))
+
+
+def format_entry(minute, text):
+    return '{} {} {}'.format(minutes_to_date(minute), minutes_to_time(minute), text)
+
+
+def record_text(record, strings):
+    "Returns text log file line of record"
+    minute, flags, _, _, text_id = record
+    if flags & FULL_TEXT:
+        return strings[text_id]
+    return format_entry(minute, strings[text_id])
+
+
+def append(path, data):
+    "Appends lines of text to binary log file"
+    table = StringTable(read_strings(path))
+    records = [make_record(line, table) for line in helpers.split_lines(data)]
+
+    # strings go first, so records never refer to missing ones
+    with open(strings_path(path), 'ab') as fp:
+        if fp.tell() == 0:
+            fp.write(MAGIC)
+        fp.write(table.pack_new())
+        if table.new:
+            fp.flush()
+            os.fsync(fp.fileno())
+    with open(path, 'ab') as fp:
+        fp.write(b''.join(RECORD.pack(*record) for record in records))
+        fp.flush()
+        os.fsync(fp.fileno())
+
+
+def write(path, lines):
+    "Atomically writes text lines as binary log file"
+    table = StringTable()
+    records = b''.join(RECORD.pack(*make_record(line, table)) for line in lines)
+
+    with open(strings_path(path) + '.tmp', 'wb') as fp:
+        fp.write(MAGIC + table.pack_new())
+    with open(path + '.tmp', 'wb') as fp:
+        fp.write(records)
+    os.rename(strings_path(path) + '.tmp', strings_path(path))
+    os.rename(path + '.tmp', path)
+
+
+def iter_text(path):
+    "Yields all lines of binary log file as text, including comments and blank lines"
+    strings = read_strings(path)
+    for record in iter_records(path):
+        yield record_text(record, strings)
+
+
+def read_lines(path, date_from=None, date_to=None):
+    "Returns entry lines of binary log file as text, like helpers.read_log_file_lines"
+    strings = read_strings(path)
+    minute_from = date_to_minutes(date_from) if date_from else None
+    minute_to = date_to_minutes(date_to) + MINUTES_IN_DAY if date_to else None
+    return [
+        record_text(record, strings) for record in iter_records(path)
+        if record[1] & ENTRY
+        and (minute_from is None or record[0] >= minute_from)
+        and (minute_to is None or record[0] < minute_to)
+    ]
+
+
+def read_last_entry(path):
+    "Returns the last entry line of binary log file as text, or None if there is none"
+    try:
+        with open(path, 'rb') as fp:
+            data_end = fp.seek(0, os.SEEK_END)
+            pos = data_end - data_end % RECORD.size
+            while pos > 0:
+                start = max(0, pos - helpers.TAIL_BLOCK_SIZE // RECORD.size * RECORD.size)
+                fp.seek(start)
+                block = fp.read(pos - start)
+                for offset in range(len(block) - RECORD.size, -1, -RECORD.size):
+                    record = RECORD.unpack_from(block, offset)
+                    if record[1] & ENTRY:
+                        return record_text(record, read_strings(path))
+                pos = start
+    except IOError:
+        pass
+    return None
+
+
+def _load_columns(path):
+    "Returns entry columns of binary log file, unpacking records one by one"
+    minutes, slack = array('i'), array('b')
+    project_ids, log_ids = array('i'), array('i')
+    for minute, flags, project_id, log_id, _ in iter_records(path):
+        if flags & ENTRY:
+            minutes.append(minute)
+            slack.append(flags & SLACK)
+            project_ids.append(project_id)
+            log_ids.append(log_id)
+    return {
+        'minutes': minutes.tobytes(),
+        'slack': slack.tobytes(),
+        'project_ids': project_ids.tobytes(),
+        'log_ids': log_ids.tobytes(),
+    }
+
+
+def _load_columns_numpy(numpy, mm):
+    "Returns entry columns of memory-mapped binary log file, viewing its records as NumPy array"
+    records = numpy.frombuffer(mm, dtype=numpy.dtype(RECORD_FIELDS), count=len(mm) // RECORD.size)
+    # entries are copied, so the mapping isn't referred to after records view is dropped
+    entries = records[records['flags'] & ENTRY != 0]
+    del records
+    return {
+        'minutes': entries['minute'].astype(numpy.intc).tobytes(),
+        'slack': (entries['flags'] & SLACK).astype(numpy.int8).tobytes(),
+        'project_ids': entries['project_id'].astype(numpy.intc).tobytes(),
+        'log_ids': entries['log_id'].astype(numpy.intc).tobytes(),
+    }
+
+
+def load_log(path):
+    "Returns ColumnarLog of binary log file's entries"
+    numpy = None
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        size = 0
+    if size // RECORD.size >= columnar.NUMPY_MIN_ROWS:
+        numpy = columnar._get_numpy()
+
+    if numpy is None:
+        columns = _load_columns(path)
+    else:
+        with open(path, 'rb') as fp:
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            columns = _load_columns_numpy(numpy, mm)
+        finally:
+            mm.close()
+
+    # projects and logs share the string table of the file
+    strings = read_strings(path)
+    columns['projects'] = columns['logs'] = strings
+    return ColumnarLog.from_columns(columns)
@@ -0,0 +1,150 @@
+"""Persistent snapshot of parsed log file
+
+Parsed log is kept as ColumnarLog columns in a marshal file under XDG cache
+directory. Snapshot is validated by log file size, modification time and
+a hash of the bytes preceding the snapshot's end, so when entries were
+only appended since the last run (the usual case with `tf log`), just
+the new tail of the log file is parsed.
+
+Set TIMEFLOW_CACHE=0 environment variable to disable the snapshot.
+"""
+import hashlib
+import os
+
+from timeflow import helpers
+from timeflow import profiling
+from timeflow.columnar import ColumnarLog
+from timeflow.log_parser import parse_line
+
+
+CACHE_VERSION = 2
+# number of bytes before snapshot's end, which are hashed to detect edits
+TAIL_HASH_SIZE = 4096
+
+
+def is_enabled():
+    return os.environ.get('TIMEFLOW_CACHE', '1') != '0'
+
+
+def cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_home, 'timeflow')
+
+
+def cache_path(log_file):
+    "Returns snapshot path of log file, unique for each log file path"
+    name = hashlib.sha1(os.path.abspath(log_file).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir(), name + '.cache')
+
+
+def _tail_hash(fp, end):
+    start = max(0, end - TAIL_HASH_SIZE)
+    fp.seek(start)
+    return hashlib.sha1(fp.read(end - start)).hexdigest()
+
+
+def _complete_end(fp, size):
+    "Returns offset after the last newline of file, so only whole lines are cached"
+    end = size
+    while end > 0:
+        start = max(0, end - helpers.TAIL_BLOCK_SIZE)
+        fp.seek(start)
+        newline = fp.read(end - start).rfind(b'\n')
+        if newline != -1:
+            return start + newline + 1
+        end = start
+    return 0
+
+
+def read_snapshot(log_file):
+    "Returns snapshot dictionary of log file, or None if there is none"
+    snapshot = helpers.read_marshal(cache_path(log_file))
+    if not isinstance(snapshot, dict) or snapshot.get('version') != CACHE_VERSION:
+        return None
+    return snapshot
+
+
+def write_snapshot(log_file, snapshot):
+    helpers.write_marshal(cache_path(log_file), snapshot)
+
+
+def _valid_end(state, fp, stat):
+    "Returns offset up to which parsed state matches log file, or 0 if it doesn't"
+    if state is None:
+        return 0
+
+    end = state['end']
+    unchanged = (stat.st_size, stat.st_mtime) == (state['size'], state['mtime'])
+    appended = stat.st_size > state['size']
+    if not (unchanged or appended):
+        return 0
+    if _tail_hash(fp, end) != state['tail_hash']:
+        return 0
+    return end
+
+
+def is_up_to_date(log_file, state):
+    "Checks whether log file wasn't changed since state was taken"
+    if state is None:
+        return False
+    try:
+        stat = os.stat(log_file)
+    except OSError:
+        return False
+    return (stat.st_size, stat.st_mtime) == (state['size'], state['mtime'])
+
+
+def refresh(log_file, log=None, state=None):
+    """Brings ColumnarLog of log file up to date
+
+    log and state are the ones returned by the previous refresh, only the
+    lines appended since then are parsed. If log file was edited or there
+    is no previous state, log is parsed from scratch.
+    Returns (log, state, changed), changed is True if state was updated.
+    """
+    parse = profiling.timed('parse', parse_line)
+
+    with open(log_file, 'rb') as fp:
+        stat = os.fstat(fp.fileno())
+        end = _valid_end(state, fp, stat) if log is not None else 0
+        complete_end = _complete_end(fp, stat.st_size)
+
+        if end:
+            # drop the unfinished last line parsed by the previous refresh
+            log.truncate(state['rows'])
+        else:
+            log = ColumnarLog()
+
+        changed = state is None or complete_end != end
+        if changed:
+            log.extend(parse(line) for line in helpers.iter_log_file_lines(end, complete_end, log_file=log_file))
+        if changed or (stat.st_size, stat.st_mtime) != (state['size'], state['mtime']):
+            state = {
+                'version': CACHE_VERSION,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'end': complete_end,
+                'tail_hash': _tail_hash(fp, complete_end),
+                'rows': len(log),
+            }
+
+    # last line without newline is still being written, so it's not cached
+    log.extend(parse(line) for line in helpers.iter_log_file_lines(complete_end, log_file=log_file))
+    return log, state, changed
+
+
+def load_log():
+    """Returns ColumnarLog of the whole log file
+
+    Snapshot is loaded and extended with the lines appended since it was
+    made, or rebuilt from scratch if log file was edited.
+    """
+    with profiling.phase('read'):
+        log_file = helpers.LOG_FILE
+        state = read_snapshot(log_file)
+        log = ColumnarLog.from_columns(state.pop('columns')) if state else None
+
+        log, state, changed = refresh(log_file, log, state)
+        if changed:
+            write_snapshot(log_file, dict(state, columns=log.to_columns(state['rows'])))
+        return log
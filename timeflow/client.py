@@ -0,0 +1,120 @@
+"""Client of timeflow daemon, see daemon module
+
+Kept apart from the daemon, so `tf log` and `tf stats` only import what's
+needed to send a request over a Unix socket, not the server and the
+parsing modules it keeps in memory.
+
+Requests and responses are single lines of JSON.
+"""
+import hashlib
+import json
+import os
+import socket
+import sys
+import tempfile
+
+from timeflow import helpers
+
+
+# seconds to wait for daemon's response before doing the work without it
+CLIENT_TIMEOUT = 5.0
+
+
+def is_supported():
+    return hasattr(socket, 'AF_UNIX')
+
+
+def runtime_dir():
+    """Returns directory of daemon sockets
+
+    It's XDG_RUNTIME_DIR, or a directory of the user in temporary
+    directory, which is created by `tf serve` accessible only by the user.
+    """
+    return os.environ.get('XDG_RUNTIME_DIR') or os.path.join(
+        tempfile.gettempdir(), 'timeflow-{}'.format(os.getuid()))
+
+
+def socket_path(log_file=None):
+    "Returns socket path of daemon serving log file, unique per user and log file"
+    if log_file is None:
+        log_file = helpers.LOG_FILE
+    name = hashlib.sha1(os.path.abspath(log_file).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(runtime_dir(), 'timeflow-{}-{}.sock'.format(os.getuid(), name))
+
+
+def is_owned(path):
+    "Checks whether path exists and belongs to the user, so socket of another user isn't trusted"
+    try:
+        return os.lstat(path).st_uid == os.getuid()
+    except OSError:
+        return False
+
+
+def request(payload, log_file=None):
+    """Sends request to daemon, returns its response
+
+    Returns None if daemon is not running or it failed, and False if
+    daemon didn't answer in CLIENT_TIMEOUT, so request may have been done.
+    """
+    if not is_supported():
+        return None
+    path = socket_path(log_file)
+    if not is_owned(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CLIENT_TIMEOUT)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+    try:
+        sock.sendall(json.dumps(payload).encode('utf-8') + b'\n')
+        response = json.loads(sock.makefile('rb').readline().decode('utf-8'))
+    except socket.timeout:
+        return False
+    except (socket.error, ValueError):
+        return None
+    finally:
+        sock.close()
+
+    if 'error' in response:
+        return None
+    return response
+
+
+def write_to_log_file(message):
+    """Writes message through daemon, returns False if daemon is not running
+
+    Message is taken as written, if daemon didn't answer in time, as it
+    may have written it already, and writing it again would repeat it.
+    """
+    response = request({'command': 'log', 'message': message})
+    if response is False:
+        sys.stderr.write('timeflow daemon didn\'t answer in time, check if message was logged\n')
+    return response is not None
+
+
+def calculate(date_from, date_to, today=False, report=True):
+    """Calculates stats through daemon, see log_parser.calculate
+
+    Returns None if daemon is not running. Work and slack time lists
+    contain a single sum, as it's all that's needed to print them.
+    """
+    response = request({
+        'command': 'stats',
+        'date_from': date_from,
+        'date_to': date_to,
+        'today': today,
+        'report': report,
+    })
+    if not response:
+        return None
+    return (
+        [response['work_time']],
+        [response['slack_time']],
+        response['today_work_time'],
+        response['work_report'],
+        response['slack_report'],
+    )
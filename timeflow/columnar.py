@@ -0,0 +1,332 @@
+"""Columnar, array backed representation of parsed log
+
+Instead of one Line object per log entry, entries are kept in parallel
+arrays: minutes since epoch, slack flags and ids of projects and logs,
+which are interned into string tables. Rows are exposed through the same
+attributes as Line, so stats and report calculations work on both.
+
+Large ranges of columns are aggregated with vectorised NumPy operations
+if NumPy is installed, falling back to a plain loop over the arrays
+otherwise.
+"""
+from array import array
+from datetime import date as date_cls
+
+from timeflow.log_parser import (
+    EPOCH_ORDINAL,
+    MINUTES_IN_DAY,
+    find_line_range,
+    new_report_dict,
+    parse_line,
+    strip_log,
+)
+
+
+# dates of days since epoch, most of rows share a date
+_day_dates_cache = {}
+# minimal number of rows, for which importing NumPy pays off
+NUMPY_MIN_ROWS = 5000
+
+numpy = None
+_numpy_imported = False
+
+
+def _get_numpy():
+    "Returns numpy module or None if it's not installed, importing it on first use"
+    global numpy, _numpy_imported
+    if not _numpy_imported:
+        _numpy_imported = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+
+def minutes_to_date(minute):
+    "Returns 'YYYY-MM-DD' date of minutes since epoch"
+    day = minute // MINUTES_IN_DAY
+    try:
+        return _day_dates_cache[day]
+    except KeyError:
+        date = date_cls.fromordinal(day + EPOCH_ORDINAL).isoformat()
+        _day_dates_cache[day] = date
+        return date
+
+
+def minutes_to_time(minute):
+    "Returns 'HH:MM' time of minutes since epoch"
+    return '{:02}:{:02}'.format(*divmod(minute % MINUTES_IN_DAY, 60))
+
+
+def _aggregate_python(log, line_begins, line_ends, report):
+    """Sums up time differences of row pairs, looping over the columns
+
+    Returns work and slack time lists and, if report is True, lists of
+    ((project_id, log_id), seconds) groups in order of their first pair.
+    """
+    minutes, slack = log.minutes, log.slack
+    project_ids, log_ids = log.project_ids, log.log_ids
+    work_time, slack_time = [], []
+    work_groups, slack_groups = {}, {}
+
+    for i in range(line_begins + 1, line_ends + 1):
+        prev_minute, minute = minutes[i-1], minutes[i]
+        # if it's day switch, skip this pair
+        if prev_minute // MINUTES_IN_DAY != minute // MINUTES_IN_DAY:
+            continue
+
+        time_diff = (minute - prev_minute) % MINUTES_IN_DAY * 60
+        if slack[i]:
+            slack_time.append(time_diff)
+            groups = slack_groups
+        else:
+            work_time.append(time_diff)
+            groups = work_groups
+
+        if report:
+            key = (project_ids[i], log_ids[i])
+            groups[key] = groups.get(key, 0) + time_diff
+
+    return work_time, slack_time, list(work_groups.items()), list(slack_groups.items())
+
+
+def _group_sums_numpy(log, line_begins, line_ends, mask, time_diffs):
+    "Returns ((project_id, log_id), seconds) groups of masked pairs, like _aggregate_python"
+    project_ids = numpy.frombuffer(log.project_ids, dtype=log.project_ids.typecode)
+    log_ids = numpy.frombuffer(log.log_ids, dtype=log.log_ids.typecode)
+    project_ids = project_ids[line_begins+1:line_ends+1][mask].astype(numpy.int64)
+    log_ids = log_ids[line_begins+1:line_ends+1][mask].astype(numpy.int64)
+
+    logs_count = max(len(log.logs), 1)
+    keys, first_pairs, groups = numpy.unique(
+        project_ids * logs_count + log_ids, return_index=True, return_inverse=True)
+    sums = numpy.zeros(len(keys), dtype=numpy.int64)
+    numpy.add.at(sums, groups.ravel(), time_diffs[mask])
+
+    order = numpy.argsort(first_pairs, kind='mergesort')
+    return [((int(keys[i] // logs_count), int(keys[i] % logs_count)), int(sums[i]))
+            for i in order]
+
+
+def _aggregate_numpy(log, line_begins, line_ends, report):
+    "Sums up time differences of row pairs with vectorised operations, like _aggregate_python"
+    minutes = numpy.frombuffer(log.minutes, dtype=log.minutes.typecode)
+    minutes = minutes[line_begins:line_ends+1].astype(numpy.int64)
+    is_slack = numpy.frombuffer(log.slack, dtype=log.slack.typecode)[line_begins+1:line_ends+1] != 0
+
+    days = minutes // MINUTES_IN_DAY
+    same_day = days[1:] == days[:-1]
+    time_diffs = (minutes[1:] - minutes[:-1]) % MINUTES_IN_DAY * 60
+    work_mask = same_day & ~is_slack
+    slack_mask = same_day & is_slack
+
+    work_time = time_diffs[work_mask].tolist()
+    slack_time = time_diffs[slack_mask].tolist()
+    work_groups, slack_groups = [], []
+    if report:
+        work_groups = _group_sums_numpy(log, line_begins, line_ends, work_mask, time_diffs)
+        slack_groups = _group_sums_numpy(log, line_begins, line_ends, slack_mask, time_diffs)
+    return work_time, slack_time, work_groups, slack_groups
+
+
+def _fill_report(log, groups, report_dict):
+    for (project_id, log_id), seconds in groups:
+        project = strip_log(log.projects[project_id])
+        log_message = strip_log(log.logs[log_id])
+        report_dict[project][log_message] += seconds
+    return report_dict
+
+
+def _is_ordered(minutes):
+    "Checks if days of minutes never decrease"
+    np = _get_numpy() if len(minutes) >= NUMPY_MIN_ROWS else None
+    if np is not None:
+        days = np.frombuffer(minutes, dtype=np.int32) // MINUTES_IN_DAY
+        return bool((days[1:] >= days[:-1]).all())
+    days = [minute // MINUTES_IN_DAY for minute in minutes]
+    return all(day <= next_day for day, next_day in zip(days, days[1:]))
+
+
+class ColumnarLine():
+    "Row of ColumnarLog, having the same attributes as Line"
+    __slots__ = ['_log', '_i']
+
+    def __init__(self, log, i):
+        self._log = log
+        self._i = i
+
+    @property
+    def minute(self):
+        return self._log.minutes[self._i]
+
+    @property
+    def date(self):
+        return minutes_to_date(self.minute)
+
+    @property
+    def time(self):
+        return minutes_to_time(self.minute)
+
+    @property
+    def project(self):
+        return self._log.projects[self._log.project_ids[self._i]]
+
+    @property
+    def log(self):
+        return self._log.logs[self._log.log_ids[self._i]]
+
+    @property
+    def is_slack(self):
+        return bool(self._log.slack[self._i])
+
+
+class _DateView():
+    "Sequence of ColumnarLog row dates, which can be used with date_begins/date_ends"
+
+    def __init__(self, log):
+        self._log = log
+
+    def __len__(self):
+        return len(self._log)
+
+    def __getitem__(self, i):
+        return minutes_to_date(self._log.minutes[i])
+
+    def __reversed__(self):
+        for i in range(len(self) - 1, -1, -1):
+            yield self[i]
+
+
+class ColumnarLog():
+    """Parsed log kept in parallel arrays
+
+    minutes - minutes since epoch of entries
+    slack - 1 for slack entries, 0 for work
+    project_ids, log_ids - indexes into projects and logs string tables
+    ordered - False if a row has an earlier date than the row before it
+    """
+
+    def __init__(self):
+        self.ordered = True
+        self.minutes = array('i')
+        self.slack = array('b')
+        self.project_ids = array('i')
+        self.log_ids = array('i')
+        self.projects = []
+        self.logs = []
+        self._project_ids = {}
+        self._log_ids = {}
+
+    @classmethod
+    def from_lines(cls, lines):
+        "Returns ColumnarLog of log file lines"
+        log = cls()
+        log.extend(parse_line(line) for line in lines)
+        return log
+
+    @classmethod
+    def from_columns(cls, columns):
+        "Returns ColumnarLog of columns dictionary, made by to_columns"
+        log = cls()
+        for name in ('minutes', 'slack', 'project_ids', 'log_ids'):
+            getattr(log, name).frombytes(columns[name])
+        log.projects = list(columns['projects'])
+        log.logs = list(columns['logs'])
+        log._project_ids = dict((project, i) for i, project in enumerate(log.projects))
+        log._log_ids = dict((log_message, i) for i, log_message in enumerate(log.logs))
+        if 'ordered' in columns:
+            log.ordered = columns['ordered']
+        else:
+            log.ordered = _is_ordered(log.minutes)
+        return log
+
+    def to_columns(self, rows=None):
+        """Returns columns of the first rows (all by default) as dictionary
+        of bytes and string tables, e.g. for serialization"""
+        if rows is None:
+            rows = len(self)
+        return {
+            'minutes': self.minutes[:rows].tobytes(),
+            'slack': self.slack[:rows].tobytes(),
+            'project_ids': self.project_ids[:rows].tobytes(),
+            'log_ids': self.log_ids[:rows].tobytes(),
+            'projects': self.projects,
+            'logs': self.logs,
+            'ordered': self.ordered,
+        }
+
+    def __len__(self):
+        return len(self.minutes)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('ColumnarLog index out of range')
+        return ColumnarLine(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield ColumnarLine(self, i)
+
+    def _intern(self, table, ids, string):
+        try:
+            return ids[string]
+        except KeyError:
+            ids[string] = len(table)
+            table.append(string)
+            return ids[string]
+
+    def append(self, line):
+        "Appends parsed Line"
+        if self.minutes and line.minute // MINUTES_IN_DAY < self.minutes[-1] // MINUTES_IN_DAY:
+            self.ordered = False
+        self.minutes.append(line.minute)
+        self.slack.append(1 if line.is_slack else 0)
+        self.project_ids.append(self._intern(self.projects, self._project_ids, line.project))
+        self.log_ids.append(self._intern(self.logs, self._log_ids, line.log))
+
+    def extend(self, lines):
+        "Appends parsed Lines"
+        for line in lines:
+            self.append(line)
+
+    def truncate(self, rows):
+        "Removes all rows after the first rows"
+        for column in (self.minutes, self.slack, self.project_ids, self.log_ids):
+            del column[rows:]
+
+    def dates(self):
+        "Returns sequence of row dates"
+        return _DateView(self)
+
+    def find_range(self, date_from, date_to):
+        "Returns first and last row indexes of date range, or None if not found"
+        return find_line_range(self.dates(), date_from, date_to, ordered=self.ordered)
+
+    def iter_range(self, date_from, date_to):
+        "Yields rows in date range"
+        line_range = self.find_range(date_from, date_to)
+        if line_range is None:
+            return iter(())
+        line_begins, line_ends = line_range
+        return (ColumnarLine(self, i) for i in range(line_begins, line_ends+1))
+
+    def aggregate(self, date_from, date_to, report=True):
+        """Sums up work and slack time of date range, see log_parser.aggregate_lines
+
+        Returns (work_time, slack_time, work_dict, slack_dict, first_line).
+        """
+        line_range = self.find_range(date_from, date_to)
+        if line_range is None:
+            return [], [], new_report_dict(), new_report_dict(), None
+
+        line_begins, line_ends = line_range
+        use_numpy = line_ends - line_begins + 1 >= NUMPY_MIN_ROWS and _get_numpy() is not None
+        aggregate = _aggregate_numpy if use_numpy else _aggregate_python
+        work_time, slack_time, work_groups, slack_groups = aggregate(
+            self, line_begins, line_ends, report)
+        work_dict = _fill_report(self, work_groups, new_report_dict())
+        slack_dict = _fill_report(self, slack_groups, new_report_dict())
+        return work_time, slack_time, work_dict, slack_dict, ColumnarLine(self, line_begins)
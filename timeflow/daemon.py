@@ -0,0 +1,189 @@
+"""Long-running daemon keeping parsed log in memory
+
+`tf serve` parses the log file once, polls it for changes, parses only the
+appended lines and answers log and stats requests over a local Unix socket.
+Calculated stats are kept until the log file changes. When the daemon is
+running, `tf log` and `tf stats` send their requests to it through client
+module, falling back to doing the work themselves otherwise.
+
+Requests and responses are single lines of JSON.
+"""
+from __future__ import print_function
+
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from timeflow import cache
+from timeflow import helpers
+from timeflow.client import is_owned, is_supported, runtime_dir, socket_path
+from timeflow.columnar import ColumnarLog
+from timeflow.log_parser import today_work_time
+from timeflow.storage import get_storage
+
+
+def _make_runtime_dir():
+    "Creates runtime directory accessible only by the user, exits if it belongs to another user"
+    path = runtime_dir()
+    if not os.path.exists(path):
+        os.makedirs(path, 0o700)
+    if not is_owned(path) or os.stat(path).st_mode & 0o077:
+        sys.exit('{} must belong to the user and be accessible only by them'.format(path))
+
+
+class LogState():
+    "Parsed log and calculated stats, kept up to date with log file"
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.lock = threading.Lock()
+        self.log = None
+        self.state = None
+        self.stats = {}
+        self.refresh()
+
+    def refresh(self):
+        with self.lock:
+            if cache.is_up_to_date(self.log_file, self.state):
+                return
+            log_storage = get_storage(self.log_file)
+            if not log_storage.is_text and log_storage.exists():
+                stat = os.stat(self.log_file)
+                self.log = log_storage.load_log()
+                self.state = {'size': stat.st_size, 'mtime': stat.st_mtime}
+            elif os.path.exists(self.log_file):
+                self.log, self.state, _ = cache.refresh(self.log_file, self.log, self.state)
+            else:
+                self.log, self.state = ColumnarLog(), None
+            self.stats.clear()
+
+    def calculate(self, date_from, date_to, today=False, report=True):
+        "Returns work and slack sums, today's work time and report dicts of date range"
+        self.refresh()
+        with self.lock:
+            key = (date_from, date_to, report)
+            if key not in self.stats:
+                work_time, slack_time, work_dict, slack_dict, first_line = self.log.aggregate(
+                    date_from, date_to, report=report)
+                self.stats[key] = (sum(work_time), sum(slack_time), work_dict, slack_dict, first_line)
+
+            work_time, slack_time, work_dict, slack_dict, first_line = self.stats[key]
+            today_time = None
+            if today and first_line is not None:
+                today_time = today_work_time(first_line)
+            return work_time, slack_time, today_time, work_dict, slack_dict
+
+    def handle(self, payload):
+        command = payload.get('command')
+        if command == 'log':
+            # answered as soon as message is written, parsed log is refreshed
+            # by the poller or the next stats request, so a failure to parse
+            # it doesn't make client write the message again
+            helpers.write_to_log_file(payload['message'])
+            return {'ok': True}
+
+        if command == 'stats':
+            work_time, slack_time, today_time, work_dict, slack_dict = self.calculate(
+                payload['date_from'], payload['date_to'],
+                today=payload.get('today', False), report=payload.get('report', True))
+            return {
+                'work_time': work_time,
+                'slack_time': slack_time,
+                'today_work_time': today_time,
+                'work_report': work_dict,
+                'slack_report': slack_dict,
+            }
+
+        return {'error': 'Unknown command: {}'.format(command)}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # connection was only checked, e.g. by `tf serve`
+            return
+        try:
+            response = self.server.log_state.handle(json.loads(line.decode('utf-8')))
+        except Exception as e:
+            response = {'error': '{}: {}'.format(type(e).__name__, e)}
+        try:
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+        except socket.error:
+            # client gave up waiting
+            pass
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def poll(log_state, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            log_state.refresh()
+        except (IOError, OSError):
+            # log file may be in the middle of being replaced by an editor
+            pass
+        except ValueError:
+            # invalid line, e.g. being edited, stats requests report it
+            pass
+
+
+def serve(poll_interval=helpers.POLL_INTERVAL):
+    "Runs daemon in foreground until it's interrupted"
+    if not is_supported():
+        sys.exit('tf serve needs Unix sockets, which are not supported on this platform')
+
+    _make_runtime_dir()
+    path = socket_path()
+    if os.path.lexists(path) and not is_owned(path):
+        sys.exit('{} belongs to another user'.format(path))
+    if _is_listening(path):
+        sys.exit('timeflow daemon is already running on {}'.format(path))
+    if os.path.lexists(path):
+        # left by a daemon, which didn't exit cleanly
+        os.remove(path)
+
+    try:
+        log_state = LogState(helpers.LOG_FILE)
+    except ValueError as e:
+        sys.exit('Can\'t parse {}: {}'.format(helpers.LOG_FILE, e))
+
+    server = Server(path, RequestHandler)
+    server.log_state = log_state
+    # clean up the socket on `kill` as well
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        poller = threading.Thread(target=poll, args=(server.log_state, poll_interval))
+        poller.daemon = True
+        poller.start()
+        print('timeflow daemon is serving {} on {}'.format(helpers.LOG_FILE, path))
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+def _is_listening(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
@@ -0,0 +1,112 @@
+"""Machine-readable stats of log files
+
+Stats are written as records of work or slack time of each project and
+log in each day, ISO week or month. Records of a period are written as
+soon as the walk over log lines leaves the period, so memory use is
+bounded by a single period of each log file, no matter how long the date
+range is.
+"""
+from collections import OrderedDict
+from itertools import groupby
+from operator import itemgetter
+import csv
+import heapq
+import json
+
+from timeflow import helpers
+from timeflow import profiling
+from timeflow.log_parser import iter_periods, merge_report, new_report_dict, parse_line
+
+
+FORMATS = ('json', 'csv', 'ndjson')
+FIELDS = ('date', 'kind', 'project', 'log', 'seconds')
+
+
+def get_fields(by='day'):
+    "Returns record fields, the first one is named after period, unless it's a day"
+    if by == 'day':
+        return FIELDS
+    return (by,) + FIELDS[1:]
+
+
+def get_paths(date_from, date_to, log_files=None):
+    "Returns paths of log files matching patterns, which have entries in date range, LOG_FILE by default"
+    from timeflow import multilog
+
+    if log_files:
+        return multilog.prune(multilog.expand_paths(log_files), date_from, date_to)
+    return [helpers.LOG_FILE]
+
+
+def iter_lines(path, date_from, date_to):
+    """Yields lines of date range of log file
+
+    Only the part of date range is read from files with an up to date index.
+    """
+    from timeflow import multilog
+
+    for line in multilog.iter_lines(path, date_from, date_to):
+        date = line[:helpers.DATE_LEN]
+        if date_from <= date <= date_to:
+            yield line
+
+
+def _iter_file_periods(path, number, date_from, date_to, by):
+    "Yields (period, number, count, work_dict, slack_dict) of log file, count keeps them sortable"
+    parse = profiling.timed('parse', parse_line)
+    parsed = (parse(line) for line in iter_lines(path, date_from, date_to))
+    for count, (period, _, _, work_dict, slack_dict) in enumerate(iter_periods(parsed, by=by)):
+        yield period, number, count, work_dict, slack_dict
+
+
+def iter_records(date_from, date_to, log_files=None, by='day'):
+    """Yields (period, kind, project, log, seconds) records of date range, period by period
+
+    Each log file is aggregated on its own, so the last entry of a file
+    isn't paired with the first entry of the next one, and reports of
+    a period of all files are merged.
+    """
+    files = [_iter_file_periods(path, number, date_from, date_to, by)
+             for number, path in enumerate(get_paths(date_from, date_to, log_files))]
+    for period, file_periods in groupby(heapq.merge(*files), key=itemgetter(0)):
+        work_dict, slack_dict = new_report_dict(), new_report_dict()
+        for _, _, _, file_work_dict, file_slack_dict in file_periods:
+            merge_report(work_dict, file_work_dict)
+            merge_report(slack_dict, file_slack_dict)
+        for kind, report_dict in (('work', work_dict), ('slack', slack_dict)):
+            for project, logs in report_dict.items():
+                for log_message, seconds in logs.items():
+                    yield period, kind, project, log_message, seconds
+
+
+def write_csv(fp, records, fields=FIELDS):
+    writer = csv.writer(fp, lineterminator='\n')
+    writer.writerow(fields)
+    for record in records:
+        writer.writerow(record)
+
+
+def write_ndjson(fp, records, fields=FIELDS):
+    for record in records:
+        fp.write(json.dumps(OrderedDict(zip(fields, record))) + '\n')
+
+
+def write_json(fp, records, fields=FIELDS):
+    "Writes records as JSON list, one record per line"
+    separator = '[\n'
+    for record in records:
+        fp.write(separator + json.dumps(OrderedDict(zip(fields, record))))
+        separator = ',\n'
+    fp.write('[]\n' if separator == '[\n' else '\n]\n')
+
+
+WRITERS = {
+    'csv': write_csv,
+    'json': write_json,
+    'ndjson': write_ndjson,
+}
+
+
+def write_stats(fp, format, date_from, date_to, log_files=None, by='day'):
+    "Writes records of periods of date range to file object fp in format, one of FORMATS"
+    WRITERS[format](fp, iter_records(date_from, date_to, log_files, by=by), get_fields(by))
@@ -5,92 +5,251 @@ from datetime import datetime as dt
 from datetime import timedelta
 
 import calendar
+import marshal
+import mmap
 import os
 import sys
 
-from termcolor import colored
+from timeflow import log_index
+from timeflow import profiling
 
 
-LOG_FILE = os.path.expanduser('~/timelog.txt')
+LOG_FILE = os.path.expanduser(os.environ.get('TIMEFLOW_LOG_FILE') or '~/timelog.txt')
 DATETIME_FORMAT = "%Y-%m-%d %H:%M"
 DATE_FORMAT = "%Y-%m-%d"
 # length of date string
 DATE_LEN = 10
 # length of datetime string
 DATETIME_LEN = 16
+# length of 'YYYY-MM' prefix
+MONTH_LEN = 7
+PERIODS = ('day', 'week', 'month')
+# size of blocks in which log file is read backwards from its end
+TAIL_BLOCK_SIZE = 4096
+# seconds between checks of log file for changes by daemon
+POLL_INTERVAL = 1.0
 
 
 def write_to_log_file(message):
-    log_message = form_log_message(message)
+    write_messages([message])
+
+
+def write_messages(messages):
+    """Writes log messages to log file with a single append
+
+    Log file is locked while its last entry is read and messages are
+    appended, so concurrent writers don't race on day separator lines.
+    Messages starting with date and time are written as they are, the
+    rest are stamped with current time.
+    """
+    # storage module is imported here, as it imports this module
+    from timeflow import storage
+
     if not os.path.exists(os.path.dirname(LOG_FILE)):
         os.makedirs(os.path.dirname(LOG_FILE))
-    with open(LOG_FILE, 'a') as fp:
-        fp.write(log_message)
+    log_storage = storage.get_storage()
+    with storage.locked(LOG_FILE):
+        data = form_log_lines(messages, log_storage.read_last_entry())
+        if data:
+            log_storage.append(data)
+
+
+def read_log_file_lines(date_from=None, date_to=None):
+    """Returns valid log file lines
+
+    If date range is passed, only the part of log file containing the date
+    range may be read, see storage module.
+    """
+    from timeflow import storage
+
+    with profiling.phase('read'):
+        return storage.get_storage().read_lines(date_from, date_to)
+
+
+def iter_log_file_lines(start=0, end=None, log_file=None):
+    """Lazily yields valid log file lines between byte offsets start and end
+
+    Log file is memory-mapped and blank lines and comments are skipped by
+    their first byte, so strings are created only for the yielded lines.
+    log_file defaults to LOG_FILE.
+    """
+    with open(log_file or LOG_FILE, 'rb') as fp:
+        try:
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file can't be mapped
+            return
+
+        try:
+            if end is None or end > len(mm):
+                end = len(mm)
+            pos = start
+            while pos < end:
+                newline = mm.find(b'\n', pos, end)
+                line_end = end if newline == -1 else newline + 1
+                if mm[pos:pos+1] not in (b'\n', b'#'):
+                    line = mm[pos:line_end].decode('utf-8')
+                    if line.endswith('\r\n'):
+                        line = line[:-2] + '\n'
+                    if _is_valid_line(line):
+                        yield line
+                pos = line_end
+        finally:
+            mm.close()
+
+
+def rebuild_log_index():
+    "Rebuilds log file index, e.g. after log file was edited"
+    log_index.rebuild_index(LOG_FILE)
+
+
+def log_file_stat(log_file=None):
+    "Returns log file size and modification time, or None if it doesn't exist"
+    try:
+        stat = os.stat(log_file or LOG_FILE)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime
 
 
-def read_log_file_lines():
-    with open(LOG_FILE, 'r') as fp:
-        return [line for line in fp.readlines() if _is_valid_line(line)]
+def read_marshal(path):
+    "Returns data of marshal file, or None if it's missing or broken"
+    try:
+        with open(path, 'rb') as fp:
+            return marshal.load(fp)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+def write_marshal(path, data):
+    """Atomically writes data to marshal file, creating its directory
+
+    Errors are ignored, as marshal files only keep cached data, which is
+    calculated again when it's missing.
+    """
+    tmp_path = path + '.tmp'
+    try:
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(tmp_path, 'wb') as fp:
+            marshal.dump(data, fp)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
 
 
 def _is_valid_line(line):
     return not (line == '\n' or line.startswith('#'))
 
 
-def form_log_message(message):
-    time_str = dt.now().strftime(DATETIME_FORMAT)
-    log_message = ' '.join((time_str, message))
-    if is_another_day():
-        return '\n' + log_message + '\n'
-    else:
-        return log_message + '\n'
+def read_last_entry():
+    "Returns the last log entry line of log file, or None if there is none"
+    from timeflow import storage
+    return storage.get_storage().read_last_entry()
 
 
-def is_another_day():
-    """
-    Checks if new message is written in the next day,
-    than the last log entry.
+def split_lines(text):
+    "Splits text into lines, keeping their line endings, like reading a file does"
+    lines = [line + '\n' for line in text.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    return lines if lines[-1] else lines[:-1]
 
-    date - message date
-    """
+
+def is_stamped(message):
+    "Checks if message starts with date and time of log entry"
     try:
-        with open(LOG_FILE, 'r') as f:
-            last_line = f.readlines()[-1]
-    except (IOError, IndexError):
+        dt.strptime(message[:DATETIME_LEN], DATETIME_FORMAT)
+    except ValueError:
         return False
+    return message[DATETIME_LEN:DATETIME_LEN+1] == ' '
 
-    last_log_date = last_line[:DATE_LEN]
 
-    # if message date is other day than last log entry return True, else False
-    if dt.now().strftime(DATE_FORMAT) != last_log_date:
-        return True
-    else:
-        return False
+def form_log_lines(messages, last_line=None):
+    "Returns log lines of messages stamped with current time, to be appended after last_line"
+    time_str = dt.now().strftime(DATETIME_FORMAT)
+    entries = (message if is_stamped(message) else ' '.join((time_str, message)) for message in messages)
+    return join_entries(entries, last_line)
+
+
+def join_entries(entries, last_line=None):
+    """Returns log lines of entries, to be appended after last_line
+
+    Entry of another day than the entry before it is preceded by a blank
+    line.
+    """
+    last_date = last_line[:DATE_LEN] if last_line else None
+    lines = []
+    for entry in entries:
+        if last_date is not None and entry[:DATE_LEN] != last_date:
+            lines.append('\n')
+        lines.append(entry + '\n')
+        last_date = entry[:DATE_LEN]
+    return ''.join(lines)
+
+
+def is_ordered(lines):
+    "Checks if dates of lines never decrease, comparing their ISO date prefixes as strings"
+    previous = None
+    for line in lines:
+        date = line[:DATE_LEN]
+        if previous is not None and date < previous:
+            return False
+        previous = date
+    return True
+
 
+def find_date_line(lines, date_to_find, reverse=False, ordered=None):
+    """Returns line index of lines, with date_to_find
 
-def find_date_line(lines, date_to_find, reverse=False):
-    "Returns line index of lines, with date_to_find"
+    Lines in chronological order are bisected, comparing their ISO date
+    prefixes as strings, otherwise (e.g. entries pasted with `tf edit`)
+    a linear scan is used instead.
+    ordered - whether lines are known to be in chronological order, e.g. by
+    log file index or by is_ordered called once per loaded log. If it's
+    None, lines are scanned, as checking them would be a scan too.
+    """
+    if not lines:
+        return None
+    if not ordered:
+        return _scan_date_line(lines, date_to_find, reverse)
+
+    lo, hi = 0, len(lines)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        date = lines[mid][:DATE_LEN]
+        if date < date_to_find or (reverse and date == date_to_find):
+            lo = mid + 1
+        else:
+            hi = mid
+
+    # lo is the first line after the searched date, when looking from the end
+    index = lo - 1 if reverse else lo
+    if index < 0 or index >= len(lines):
+        return None
+    return index
+
+
+def _scan_date_line(lines, date_to_find, reverse=False):
+    "Returns line index of lines, with date_to_find, by scanning all lines"
     len_lines = len(lines) - 1
     if reverse:
         lines = reversed(lines)
     for i, line in enumerate(lines):
-        date_obj = dt.strptime(line[:DATE_LEN], DATE_FORMAT)
-        date_to_find_obj = dt.strptime(date_to_find, DATE_FORMAT)
-
-        if reverse and date_obj <= date_to_find_obj:
+        date = line[:DATE_LEN]
+        if reverse and date <= date_to_find:
             return len_lines - i
-        elif not reverse and date_obj >= date_to_find_obj:
+        elif not reverse and date >= date_to_find:
             return i
 
 
-def date_begins(lines, date_to_find):
+def date_begins(lines, date_to_find, ordered=None):
     "Returns first line out of lines, with date_to_find"
-    return find_date_line(lines, date_to_find)
+    return find_date_line(lines, date_to_find, ordered=ordered)
 
 
-def date_ends(lines, date_to_find):
+def date_ends(lines, date_to_find, ordered=None):
     "Returns last line out of lines, with date_to_find"
-    return find_date_line(lines, date_to_find, reverse=True)
+    return find_date_line(lines, date_to_find, reverse=True, ordered=ordered)
 
 
 def get_time(seconds):
@@ -159,6 +318,18 @@ def get_month_range(arg):
     return date_from, date_to
 
 
+def get_period(date, by):
+    """Returns period of 'YYYY-MM-DD' date, which is one of PERIODS
+
+    Period is the date itself, its ISO week ('YYYY-Www') or month ('YYYY-MM').
+    """
+    if by == 'month':
+        return date[:MONTH_LEN]
+    if by == 'week':
+        return '{:04}-W{:02}'.format(*dt.strptime(date, DATE_FORMAT).isocalendar()[:2])
+    return date
+
+
 def get_last_month():
     month = dt.now().month - 1
     if month == 12:
@@ -177,6 +348,27 @@ def print_stats(work_time, slack_time, today_work_time):
     print(slack_string)
 
 
+def print_periods(period_stats, report=False, colorize=False):
+    """Prints work and slack time of each period and their total
+
+    period_stats - see log_parser.calculate_periods. If report is True,
+    time of each project is printed under its period, too.
+    """
+    colorize_fn = _make_colorizer(colorize)
+    row = '{:<10}  Work: {:02}h {:02}m  Slack: {:02}h {:02}m'
+    work_seconds = slack_seconds = 0
+    for period, (work_time, slack_time, work_dict, slack_dict) in period_stats.items():
+        work_seconds += sum(work_time)
+        slack_seconds += sum(slack_time)
+        print(row.format(period, *(get_time(sum(work_time)) + get_time(sum(slack_time)))))
+        if report:
+            for report_dict, suffix in ((work_dict, ''), (slack_dict, ' (slack)')):
+                for project, logs in sorted(report_dict.items()):
+                    hours, minutes = get_time(sum(logs.values()))
+                    print('    {}: {}h {}m{}'.format(colorize_fn('project_name', project), hours, minutes, suffix))
+    print(row.format('Total', *(get_time(work_seconds) + get_time(slack_seconds))))
+
+
 def print_today_work_time(today_work_time):
     if today_work_time:
         today_hours, today_minutes = get_time(today_work_time)
@@ -241,6 +433,9 @@ def _make_colorizer(colorize):
         'slack_header': ['bold'],
     }
 
+    # termcolor is imported only when colors are used, to keep startup fast
+    from termcolor import colored
+
     def _colorize(category, str):
         return colored(str, color=colors.get(category, None), attrs=attrs.get(category, None))
 
@@ -0,0 +1,217 @@
+"""Import of log entries exported from other time loggers
+
+Entries are read from CSV, JSON or gtimelog files, validated and sorted by
+their date and time. If all of them are newer than the last entry of log
+file, they are appended to it, otherwise log file is rewritten once with
+entries merged in their chronological position. Either way log file index
+and day summaries are updated once for the whole import.
+
+CSV file has a header with datetime (or date and time) and message
+columns. JSON file is a list of objects with the same keys, or one object
+per line. gtimelog file has lines like '2015-01-01 08:00: message'.
+"""
+import csv
+import io
+import json
+import os
+import re
+import sys
+
+from timeflow import helpers
+from timeflow import storage
+from timeflow.log_parser import date_to_minutes
+
+
+FORMATS = ('csv', 'json', 'gtimelog')
+FORMAT_SUFFIXES = {
+    '.csv': 'csv',
+    '.json': 'json',
+    '.jsonl': 'json',
+    '.ndjson': 'json',
+}
+
+# 'YYYY-MM-DD HH:MM', also with 'T' separator and seconds, like ISO 8601
+DATETIME_RE = re.compile(r'(\d{4}-\d\d-\d\d)[ T](\d\d):(\d\d)(?::\d\d(?:\.\d+)?)?$')
+GTIMELOG_RE = re.compile(r'(\d{4}-\d\d-\d\d \d\d:\d\d)(?::\d\d)?: ?(.*)$')
+
+
+def guess_format(path):
+    "Returns format of file by its extension, gtimelog by default"
+    return FORMAT_SUFFIXES.get(os.path.splitext(path)[1].lower(), 'gtimelog')
+
+
+def read_gtimelog(fp):
+    "Yields (line number, datetime, message) of gtimelog file"
+    for number, line in enumerate(fp, 1):
+        line = line.rstrip('\r\n')
+        if not line.strip() or line.startswith('#'):
+            continue
+        match = GTIMELOG_RE.match(line)
+        if match is None:
+            yield number, line, None
+        else:
+            yield number, match.group(1), match.group(2)
+
+
+def _row_datetime(row):
+    if row.get('datetime'):
+        return row['datetime']
+    if row.get('date') and row.get('time'):
+        return '{} {}'.format(row['date'], row['time'])
+    return None
+
+
+def read_csv(fp):
+    "Yields (line number, datetime, message) of CSV file with a header"
+    reader = csv.DictReader(fp)
+    for row in reader:
+        yield reader.line_num, _row_datetime(row), row.get('message')
+
+
+def read_json(fp):
+    "Yields (item number, datetime, message) of JSON list or of JSON lines"
+    text = fp.read()
+    try:
+        if text.lstrip().startswith('['):
+            items = json.loads(text)
+        else:
+            items = [json.loads(line) for line in text.splitlines() if line.strip()]
+    except ValueError as e:
+        sys.exit('Invalid JSON: {}'.format(e))
+
+    for number, item in enumerate(items, 1):
+        if not isinstance(item, dict):
+            yield number, None, None
+        else:
+            yield number, _row_datetime(item), item.get('message')
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+    'gtimelog': read_gtimelog,
+}
+
+
+def make_entry(datetime, message):
+    "Returns log entry of datetime and message, raises ValueError if they are invalid"
+    match = DATETIME_RE.match((datetime or '').strip())
+    if match is None:
+        raise ValueError('invalid date and time {!r}'.format(datetime))
+    date, hours, minutes = match.group(1, 2, 3)
+    # raises ValueError for days, which don't exist
+    date_to_minutes(date)
+    if int(hours) > 23 or int(minutes) > 59:
+        raise ValueError('invalid date and time {!r}'.format(datetime))
+
+    if message is None or not message.strip() or '\n' in message or '\r' in message:
+        raise ValueError('message must be a single non-empty line')
+    return '{} {}:{} {}'.format(date, hours, minutes, message.strip())
+
+
+def read_entries(fp, format):
+    """Returns validated entries of file sorted by their date and time
+
+    Entries of the same minute keep their order. Exits with the first
+    invalid entry's number.
+    """
+    entries = []
+    for number, datetime, message in READERS[format](fp):
+        try:
+            entries.append(make_entry(datetime, message))
+        except ValueError as e:
+            sys.exit('Invalid entry {}: {}'.format(number, e))
+    entries.sort(key=lambda entry: entry[:helpers.DATETIME_LEN])
+    return entries
+
+
+def _is_entry(line):
+    return line.strip() and not line.startswith('#')
+
+
+def merge(lines, entries):
+    """Returns lines of log file with sorted entries merged in chronological position
+
+    Entry is put before the first log file entry, which is later than it.
+    Comments and blank lines of log file are kept, blank lines are added
+    between days of merged entries.
+    """
+    if lines and not lines[-1].endswith('\n'):
+        lines[-1] += '\n'
+
+    merged = []
+    # blank lines and comments after the last entry, entries of the same day are put before them
+    pending = []
+    last_date = None
+    last_imported = False
+    i = 0
+    for line in lines + [None]:
+        if line is not None and not _is_entry(line):
+            pending.append(line)
+            continue
+
+        while i < len(entries) and (line is None or entries[i][:helpers.DATETIME_LEN] < line[:helpers.DATETIME_LEN]):
+            date = entries[i][:helpers.DATE_LEN]
+            if date != last_date:
+                merged.extend(pending)
+                pending = []
+                if last_date is not None and merged[-1] != '\n':
+                    merged.append('\n')
+            merged.append(entries[i] + '\n')
+            last_date, last_imported = date, True
+            i += 1
+        if line is None:
+            break
+
+        merged.extend(pending)
+        pending = []
+        date = line[:helpers.DATE_LEN]
+        if last_imported and date != last_date and merged[-1] != '\n':
+            merged.append('\n')
+        merged.append(line)
+        last_date, last_imported = date, False
+
+    merged.extend(pending)
+    return merged
+
+
+def import_entries(entries, log_file=None):
+    """Writes sorted entries to log file, log_file defaults to LOG_FILE
+
+    Entries are appended, if none of them is earlier than the last entry
+    of log file, otherwise log file is rewritten with entries merged in.
+    Log file is locked meanwhile (see storage.locked), so entries logged
+    during import are appended to the rewritten log file.
+    """
+    if not entries:
+        return
+    log_file = log_file or helpers.LOG_FILE
+    if not os.path.exists(os.path.dirname(log_file)):
+        os.makedirs(os.path.dirname(log_file))
+
+    log_storage = storage.get_storage(log_file)
+    with storage.locked(log_file):
+        last_line = log_storage.read_last_entry()
+        if last_line is None or entries[0][:helpers.DATETIME_LEN] >= last_line[:helpers.DATETIME_LEN]:
+            log_storage.append(helpers.join_entries(entries, last_line))
+        else:
+            log_storage.write(merge(list(log_storage.iter_text()), entries))
+
+
+def import_file(path, format=None, log_file=None):
+    """Imports entries of file, '-' reads standard input
+
+    format - one of FORMATS, guessed by file's extension by default.
+    Returns the number of imported entries.
+    """
+    format = format or guess_format(path)
+    if path == '-':
+        entries = read_entries(sys.stdin, format)
+    else:
+        try:
+            with io.open(os.path.expanduser(path), encoding='utf-8', newline='') as fp:
+                entries = read_entries(fp, format)
+        except IOError as e:
+            sys.exit('Can\'t read {}: {}'.format(path, e))
+    import_entries(entries, log_file)
+    return len(entries)
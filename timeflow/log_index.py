@@ -0,0 +1,134 @@
+"""Sidecar date index of log file
+
+Index maps every date of log file to byte offset of its first entry, so
+date ranges can be read by seeking instead of reading the whole file.
+Log file size and modification time are stored along, to detect that
+the file was changed behind index's back (e.g. by an editor).
+"""
+from bisect import bisect_left, bisect_right
+import json
+import os
+
+
+INDEX_VERSION = 1
+# length of date string
+DATE_LEN = 10
+
+
+def index_path(log_file):
+    return log_file + '.idx'
+
+
+def _file_stat(log_file):
+    stat = os.stat(log_file)
+    return stat.st_size, stat.st_mtime
+
+
+def _is_entry(line):
+    return not (line.strip() == b'' or line.startswith(b'#'))
+
+
+def new_index():
+    return {
+        'version': INDEX_VERSION,
+        'size': 0,
+        'mtime': None,
+        'ordered': True,
+        'dates': [],
+    }
+
+
+def add_lines(index, offset, lines):
+    """Adds dates of lines, starting at byte offset, to index
+
+    lines are raw byte lines, as read from log file opened in binary mode.
+    """
+    dates = index['dates']
+    for line in lines:
+        if _is_entry(line):
+            date = line[:DATE_LEN].decode('utf-8')
+            if not dates or dates[-1][0] < date:
+                dates.append([date, offset])
+            elif dates[-1][0] > date:
+                # entries are out of order, index can't be used for seeking
+                index['ordered'] = False
+        offset += len(line)
+    return index
+
+
+def build_index(log_file):
+    "Builds index by reading the whole log file"
+    index = new_index()
+    with open(log_file, 'rb') as fp:
+        add_lines(index, 0, fp)
+    index['size'], index['mtime'] = _file_stat(log_file)
+    return index
+
+
+def write_index(log_file, index):
+    "Atomically writes index next to log file, it's rebuilt by the next write, if that fails"
+    path = index_path(log_file)
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'w') as fp:
+            json.dump(index, fp, separators=(',', ':'))
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+
+def load_index(log_file):
+    "Returns index of log file, or None if it's missing or out of date"
+    try:
+        with open(index_path(log_file), 'r') as fp:
+            index = json.load(fp)
+        size, mtime = _file_stat(log_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if index.get('version') != INDEX_VERSION:
+        return None
+    if (index['size'], index['mtime']) != (size, mtime):
+        return None
+    return index
+
+
+def update_index(log_file, index, offset, data):
+    """Updates index after data was appended to log file at byte offset
+
+    index is the one loaded before appending, if it was missing or out of
+    date whole index is rebuilt.
+    """
+    if index is None or index['size'] != offset:
+        index = build_index(log_file)
+    else:
+        add_lines(index, offset, data.splitlines(True))
+        index['size'], index['mtime'] = _file_stat(log_file)
+    write_index(log_file, index)
+    return index
+
+
+def rebuild_index(log_file):
+    "Rebuilds index of log file, if log file exists"
+    if os.path.exists(log_file):
+        write_index(log_file, build_index(log_file))
+
+
+def find_offsets(index, date_from=None, date_to=None):
+    """Returns byte offsets (start, end) of log file part with date range
+
+    end is None if the part reaches end of file. If index can't be used
+    for seeking, offsets of the whole file are returned.
+    """
+    if not index['ordered']:
+        return 0, None
+
+    dates = [date for date, _ in index['dates']]
+    start, end = 0, None
+    if date_from is not None:
+        i = bisect_left(dates, date_from)
+        start = index['dates'][i][1] if i < len(dates) else index['size']
+    if date_to is not None:
+        i = bisect_right(dates, date_to)
+        end = index['dates'][i][1] if i < len(dates) else None
+    return start, end
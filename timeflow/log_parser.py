@@ -1,25 +1,69 @@
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from itertools import groupby
 import re
 
+from datetime import date as date_cls
 from datetime import datetime as dt
 
+from timeflow import helpers
+from timeflow import log_index
+from timeflow import profiling
 from timeflow.helpers import (
+    DATE_FORMAT,
     DATETIME_FORMAT,
     date_begins,
     date_ends,
+    get_period,
+    is_ordered,
     read_log_file_lines,
 )
 
 
+MINUTES_IN_DAY = 24 * 60
+TIME_FORMAT = '%H:%M'
+EPOCH_ORDINAL = date_cls(1970, 1, 1).toordinal()
+
+# minutes since epoch of dates' midnights, most of log lines share a date
+_date_minutes_cache = {}
+
+
+def date_to_minutes(date):
+    "Returns minutes since epoch of 'YYYY-MM-DD' date's midnight"
+    try:
+        return _date_minutes_cache[date]
+    except KeyError:
+        if len(date) == 10 and date[4] == date[7] == '-':
+            ordinal = date_cls(int(date[:4]), int(date[5:7]), int(date[8:10])).toordinal()
+        else:
+            # e.g. date without zero padding
+            ordinal = dt.strptime(date, DATE_FORMAT).toordinal()
+        minutes = (ordinal - EPOCH_ORDINAL) * MINUTES_IN_DAY
+        _date_minutes_cache[date] = minutes
+        return minutes
+
+
+def time_to_minutes(time):
+    "Returns minutes since midnight of 'HH:MM' time"
+    if len(time) == 5 and time[2] == ':':
+        return int(time[:2]) * 60 + int(time[3:5])
+    # e.g. time without zero padding, like '8:00'
+    parsed = dt.strptime(time, TIME_FORMAT)
+    return parsed.hour * 60 + parsed.minute
+
+
 class Line():
-    __slots__ = ['date', 'time', 'project', 'log', 'is_slack']
+    __slots__ = ['date', 'time', 'project', 'log', 'is_slack', 'minute']
 
-    def __init__(self, date, time, project, log, is_slack):
+    def __init__(self, date, time, project, log, is_slack, minute=None):
         self.date = date
         self.time = time
         self.project = project
         self.log = log
         self.is_slack = is_slack
+        # minutes since epoch, so time differences are integer subtraction
+        if minute is None:
+            minute = date_to_minutes(date) + time_to_minutes(time)
+        self.minute = minute
 
 
 def clean_line(time, project, log):
@@ -85,121 +129,266 @@ def parse_line(line):
     return Line(date, time, project, log, is_slack)
 
 
-def parse_lines():
+def parse_entry(line):
+    "Returns Line of log file line, or None if it's not a valid entry, e.g. a comment"
+    if line == '\n' or line.startswith('#'):
+        return None
+    try:
+        return parse_line(line)
+    except ValueError:
+        return None
+
+
+def parse_lines(lines=None):
     """Returns a list of objects representing log file"""
-    lines = read_log_file_lines()
-    data = []
-    for line in lines:
-        data.append(parse_line(line))
-    return data
+    if lines is None:
+        lines = read_log_file_lines()
+    return [parse_line(line) for line in lines]
 
 
-def calc_time_diff(line, next_line):
-    line_time = dt.strptime(
-        "{} {}".format(line.date, line.time),
-        DATETIME_FORMAT
-    )
-    next_line_time = dt.strptime(
-        "{} {}".format(next_line.date, next_line.time),
-        DATETIME_FORMAT
-    )
-    return (next_line_time - line_time).seconds
+def iter_parsed_lines(lines, line_begins=0, line_ends=None):
+    """Yields objects representing lines[line_begins:line_ends+1]
 
+    Lines are parsed lazily, so only the requested window is ever parsed.
+    """
+    if line_ends is None:
+        line_ends = len(lines) - 1
+    parse = profiling.timed('parse', parse_line)
+    for i in range(line_begins, line_ends+1):
+        yield parse(lines[i])
 
-def calculate_stats(lines, date_from, date_to, today=False):
-    work_time = []
-    slack_time = []
-    today_work_time = None
 
-    line_begins = date_begins(lines, date_from)
-    line_ends = date_ends(lines, date_to)
+def find_line_range(lines, date_from, date_to, ordered=None):
+    """Returns first and last line indexes of date range, or None if not found
 
-    date_not_found = (line_begins is None or line_ends < line_begins)
+    ordered - whether lines are known to be in chronological order, see
+    helpers.find_date_line.
+    """
+    with profiling.phase('date lookup'):
+        if ordered is None:
+            ordered = is_ordered(lines)
+        line_begins = date_begins(lines, date_from, ordered=ordered)
+        line_ends = date_ends(lines, date_to, ordered=ordered)
+
+    date_not_found = (line_begins is None or line_ends is None or line_ends < line_begins)
     if date_not_found:
-        return work_time, slack_time, today_work_time
+        return None
+    return line_begins, line_ends
 
-    data = parse_lines()
 
-    for i, line in enumerate(data[line_begins:line_ends+1]):
-        # if we got to the last line - stop
-        if line_begins+i+1 > line_ends:
-            break
+def parse_range(lines, date_from, date_to, ordered=None):
+    "Yields objects representing lines, which are in date range"
+    line_range = find_line_range(lines, date_from, date_to, ordered=ordered)
+    if line_range is None:
+        return iter(())
+    return iter_parsed_lines(lines, *line_range)
 
-        next_line = data[line_begins+i+1]
 
-        line_date = line.date
-        next_line_date = next_line.date
+class ParsedLog():
+    """Log file lines, parsed on demand
 
-        # if it's day switch, skip this cycle
-        if line_date != next_line_date:
-            continue
+    Only the lines of the requested date range are ever parsed. Log file
+    with an up to date index of ordered dates isn't read into memory: the
+    part of each requested date range is streamed from the memory-mapped
+    file, so memory use doesn't grow with the date range. Otherwise log
+    file (or the part of date range passed) is read once, so stats and
+    report calculations share it, and lines are checked to be in
+    chronological order once.
+    """
 
-        if next_line.is_slack:
-            slack_time.append(calc_time_diff(line, next_line))
-        else:
-            work_time.append(calc_time_diff(line, next_line))
+    def __init__(self, lines=None, date_from=None, date_to=None):
+        self.ordered = None
+        self.index = None
+        self.log_file = helpers.LOG_FILE
+        if lines is None:
+            index = log_index.load_index(self.log_file)
+            if index is not None and index['ordered']:
+                self.index = index
+                self.ordered = True
+            else:
+                lines = read_log_file_lines(date_from, date_to)
+        self.lines = lines
 
-    if today:
-        today_start_time = dt.strptime(
-            "{} {}".format(data[line_begins].date, data[line_begins].time),
-            DATETIME_FORMAT
-        )
-        today_work_time = (dt.now() - today_start_time).seconds
+    def iter_range(self, date_from, date_to):
+        "Yields objects representing log lines in date range"
+        if self.index is not None:
+            return self._stream_range(date_from, date_to)
+        if self.ordered is None:
+            self.ordered = is_ordered(self.lines)
+        return parse_range(self.lines, date_from, date_to, ordered=self.ordered)
 
-    return work_time, slack_time, today_work_time
+    def _stream_range(self, date_from, date_to):
+        "Yields parsed lines of the part of log file with date range, found by index"
+        with profiling.phase('date lookup'):
+            start, end = log_index.find_offsets(self.index, date_from, date_to)
+        parse = profiling.timed('parse', parse_line)
+        for line in helpers.iter_log_file_lines(start, end, log_file=self.log_file):
+            yield parse(line)
 
 
-def calculate_report(lines, date_from, date_to):
-    """Creates and returns report dictionaries
+def _as_parsed_log(lines):
+    # ParsedLog or any other parsed representation, e.g. ColumnarLog
+    if hasattr(lines, 'iter_range'):
+        return lines
+    return ParsedLog(lines)
 
-    Report dicts have form like this:
-    {<Project>: {<log_message>: <accumulative time>},
-                {<log_message1>: <accumulative time1>}}
-    """
-    work_dict = defaultdict(lambda: defaultdict(dict))
-    slack_dict = defaultdict(lambda: defaultdict(dict))
 
-    line_begins = date_begins(lines, date_from)
-    line_ends = date_ends(lines, date_to)
+def calc_time_diff(line, next_line):
+    "Returns seconds between lines, wrapped to a day like timedelta.seconds"
+    return (next_line.minute - line.minute) % MINUTES_IN_DAY * 60
 
-    date_not_found = (line_begins is None or line_ends < line_begins)
-    if date_not_found:
-        return work_dict, slack_dict
 
-    data = parse_lines()
+def new_report_dict():
+    "Returns empty report dictionary, see calculate_report"
+    return defaultdict(lambda: defaultdict(int))
+
 
-    for i, line in enumerate(data[line_begins:line_ends+1]):
-        # if we got to the last line - stop
-        if line_begins+i+1 > line_ends:
-            break
+def merge_report(report_dict, other_dict):
+    "Adds times of other report dictionary to report dictionary"
+    for project, logs in other_dict.items():
+        for log_message, seconds in logs.items():
+            report_dict[project][log_message] += seconds
 
-        next_line = data[line_begins+i+1]
 
-        line_date = line.date
-        next_line_date = next_line.date
-        # if it's day switch, skip this cycle
-        if line_date != next_line_date:
+def aggregate_lines(data, report=True):
+    """Walks over pairs of parsed lines and sums up their time differences
+
+    Returns (work_time, slack_time, work_dict, slack_dict, first_line),
+    first_line is None if there are no lines.
+    """
+    work_time = []
+    slack_time = []
+    work_dict = new_report_dict()
+    slack_dict = new_report_dict()
+
+    data = iter(data)
+    first_line = next(data, None)
+    if first_line is None:
+        return work_time, slack_time, work_dict, slack_dict, first_line
+
+    line = first_line
+    for next_line in data:
+        # if it's day switch, skip this pair
+        if line.date != next_line.date:
+            line = next_line
             continue
 
         time_diff = calc_time_diff(line, next_line)
 
-        project = strip_log(next_line.project)
-        log = strip_log(next_line.log)
         if next_line.is_slack:
+            slack_time.append(time_diff)
+        else:
+            work_time.append(time_diff)
+
+        if report:
             # if log message is identical add time_diff
             # to total time of the log
-            if slack_dict[project][log]:
-                total_time = slack_dict[project][log]
-                total_time += time_diff
-                slack_dict[project][log] = total_time
+            project = strip_log(next_line.project)
+            log_message = strip_log(next_line.log)
+            if next_line.is_slack:
+                slack_dict[project][log_message] += time_diff
             else:
-                slack_dict[project][log] = time_diff
+                work_dict[project][log_message] += time_diff
+
+        line = next_line
+
+    return work_time, slack_time, work_dict, slack_dict, first_line
+
+
+def calculate(lines, date_from, date_to, today=False, report=True):
+    """Calculates stats and report dictionaries in a single walk over the log
+
+    lines can be either a list of log file lines or a parsed log object
+    (ParsedLog or ColumnarLog). Parsed log can provide its own aggregate()
+    method, e.g. ColumnarLog aggregates its columns with NumPy.
+    Returns (work_time, slack_time, today_work_time, work_dict, slack_dict),
+    report dictionaries are left empty if report is False.
+    """
+    log = _as_parsed_log(lines)
+    with profiling.phase('aggregation'):
+        if hasattr(log, 'aggregate'):
+            aggregated = log.aggregate(date_from, date_to, report=report)
         else:
-            if work_dict[project][log]:
-                total_time = work_dict[project][log]
-                total_time += time_diff
-                work_dict[project][log] = total_time
-            else:
-                work_dict[project][log] = time_diff
+            aggregated = aggregate_lines(log.iter_range(date_from, date_to), report=report)
+    work_time, slack_time, work_dict, slack_dict, first_line = aggregated
+
+    today_time = None
+    if today and first_line is not None:
+        today_time = today_work_time(first_line)
+
+    return work_time, slack_time, today_time, work_dict, slack_dict
+
+
+def iter_periods(data, by='day', report=True):
+    """Walks over parsed lines once, yielding stats of each day, week or month
+
+    Yields (period, work_time, slack_time, work_dict, slack_dict) as soon
+    as the walk leaves period, see helpers.get_period. Pairs of lines in
+    different days are skipped by aggregate_lines, so periods are summed
+    the same way as the whole date range.
+    """
+    periods = {}
+
+    def period_of(line):
+        try:
+            return periods[line.date]
+        except KeyError:
+            periods[line.date] = get_period(line.date, by)
+            return periods[line.date]
+
+    for period, lines in groupby(data, key=period_of):
+        work_time, slack_time, work_dict, slack_dict, _ = aggregate_lines(lines, report=report)
+        yield period, work_time, slack_time, work_dict, slack_dict
 
+
+def calculate_periods(lines, date_from, date_to, by='day', report=True):
+    """Calculates stats of each day, week or month of date range in a single walk
+
+    Returns OrderedDict of {period: (work_time, slack_time, work_dict,
+    slack_dict)} sorted by period. Stats of a period are merged, if its
+    lines aren't next to each other, e.g. in out of order log file.
+    """
+    log = _as_parsed_log(lines)
+    stats = {}
+    with profiling.phase('aggregation'):
+        for period_stats in iter_periods(log.iter_range(date_from, date_to), by=by, report=report):
+            merge_period(stats, *period_stats)
+    return OrderedDict(sorted(stats.items()))
+
+
+def merge_period(stats, period, work_time, slack_time, work_dict, slack_dict):
+    "Adds stats of period to {period: (work_time, slack_time, work_dict, slack_dict)} dictionary"
+    if period not in stats:
+        stats[period] = (work_time, slack_time, work_dict, slack_dict)
+        return
+    period_stats = stats[period]
+    period_stats[0].extend(work_time)
+    period_stats[1].extend(slack_time)
+    merge_report(period_stats[2], work_dict)
+    merge_report(period_stats[3], slack_dict)
+
+
+def today_work_time(first_line):
+    "Returns seconds passed since first line of today"
+    today_start_time = dt.strptime(
+        "{} {}".format(first_line.date, first_line.time),
+        DATETIME_FORMAT
+    )
+    return (dt.now() - today_start_time).seconds
+
+
+def calculate_stats(lines, date_from, date_to, today=False):
+    work_time, slack_time, today_work_time, _, _ = calculate(
+        lines, date_from, date_to, today=today, report=False)
+    return work_time, slack_time, today_work_time
+
+
+def calculate_report(lines, date_from, date_to):
+    """Creates and returns report dictionaries
+
+    Report dicts have form like this:
+    {<Project>: {<log_message>: <accumulative time>},
+                {<log_message1>: <accumulative time1>}}
+    """
+    _, _, _, work_dict, slack_dict = calculate(lines, date_from, date_to)
     return work_dict, slack_dict
@@ -1,13 +1,19 @@
 import sys
+import time
 
+# profiling goes first, so it can time the rest of imports
+from timeflow import profiling
 from timeflow import arg_parser
 
+IMPORTED = time.time()
+
 
 def main(args=sys.argv[1:]):
     args = arg_parser.parse_args(args)
     # if no command is passed, invoke help
     if hasattr(args, 'func'):
-        args.func(args)
+        with profiling.profile(args.profile, args.profile_output, imported=IMPORTED):
+            args.func(args)
     else:
         arg_parser.parse_args(['--help'])
 
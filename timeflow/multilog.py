@@ -0,0 +1,247 @@
+"""Stats of several log files or of chunks of a large one, parsed in parallel
+
+Log files are given as paths or glob patterns, gzip-compressed (ending
+with .gz), binary and SQLite log files are read as well. Files, which have no entries in the
+requested date range, are skipped by their first and last dates, the rest
+are parsed in parallel by a process pool and their stats are merged.
+
+First and last dates of a file are taken from its index if it has an up to
+date one, otherwise the file is scanned once and its dates are kept in
+cache directory until the file changes.
+
+A single log file with an up to date index is split into chunks at offsets
+of its dates instead. The pair of lines straddling a chunk edge is a day
+switch, which is skipped by the calculation anyway, so merged stats of
+chunks are the same as stats of the whole range.
+"""
+from bisect import bisect_left
+import glob
+import gzip
+import multiprocessing
+import os
+import sys
+
+from timeflow import binlog
+from timeflow import cache
+from timeflow import helpers
+from timeflow import log_index
+from timeflow import profiling
+from timeflow import storage
+from timeflow.log_parser import calculate, merge_report, new_report_dict
+
+
+# bytes of date range, from which a single log file is parsed in chunks
+# by default, as it pays off the cost of starting processes
+PARALLEL_MIN_SIZE = 64 * 1024 * 1024
+
+
+def expand_paths(patterns):
+    "Returns sorted paths of log files matching patterns, skipping their indexes, string tables, locks and journals"
+    skipped_suffixes = (log_index.index_path(''), storage.BINARY_LOG_SUFFIX + binlog.STRINGS_SUFFIX,
+                        storage.LOCK_SUFFIX, '-journal', '-wal', '-shm')
+    paths = set()
+    for pattern in patterns:
+        matched = glob.glob(os.path.expanduser(pattern))
+        if not matched:
+            sys.exit('No log files match {}'.format(pattern))
+        paths.update(path for path in matched if not path.endswith(skipped_suffixes))
+    return sorted(paths)
+
+
+def is_compressed(path):
+    return path.endswith('.gz')
+
+
+def iter_lines(path, date_from=None, date_to=None):
+    """Yields valid lines of log file
+
+    Only the part of date range is read from uncompressed files with
+    an up to date index.
+    """
+    if is_compressed(path):
+        with gzip.open(path, 'rb') as fp:
+            for line in fp:
+                line = line.decode('utf-8')
+                if line.endswith('\r\n'):
+                    line = line[:-2] + '\n'
+                elif not line.endswith('\n'):
+                    line += '\n'
+                if helpers._is_valid_line(line):
+                    yield line
+        return
+
+    log_storage = storage.get_storage(path)
+    if not log_storage.is_text:
+        for line in log_storage.read_lines(date_from, date_to):
+            yield line
+        return
+
+    start, end = 0, None
+    index = log_index.load_index(path)
+    if index is not None and (date_from is not None or date_to is not None):
+        start, end = log_index.find_offsets(index, date_from, date_to)
+    for line in helpers.iter_log_file_lines(start, end, log_file=path):
+        yield line
+
+
+def _bounds_path():
+    return os.path.join(cache.cache_dir(), 'bounds')
+
+
+def _read_bounds():
+    bounds = helpers.read_marshal(_bounds_path())
+    return bounds if isinstance(bounds, dict) else {}
+
+
+def _scan_bounds(path):
+    first = last = None
+    for line in iter_lines(path):
+        date = line[:helpers.DATE_LEN]
+        first = min(date, first or date)
+        last = max(date, last or date)
+    return first, last
+
+
+def file_bounds(paths):
+    "Returns {path: (first date, last date)} of log files, dates are None if file has no entries"
+    cached = _read_bounds() if cache.is_enabled() else {}
+    bounds = {}
+    for path in paths:
+        index = None
+        if not is_compressed(path) and storage.get_storage(path).is_text:
+            index = log_index.load_index(path)
+        if index is not None and index['ordered']:
+            dates = index['dates']
+            bounds[path] = (dates[0][0], dates[-1][0]) if dates else (None, None)
+            continue
+
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        entry = cached.get(key)
+        if entry is None or entry[:2] != [stat.st_size, stat.st_mtime]:
+            entry = [stat.st_size, stat.st_mtime] + list(_scan_bounds(path))
+            cached[key] = entry
+        bounds[path] = tuple(entry[2:])
+
+    if cache.is_enabled():
+        helpers.write_marshal(_bounds_path(), cached)
+    return bounds
+
+
+def prune(paths, date_from, date_to):
+    "Returns paths of log files, which have entries in date range"
+    bounds = file_bounds(paths)
+    return [
+        path for path in paths
+        if bounds[path][0] is not None and bounds[path][0] <= date_to and bounds[path][1] >= date_from
+    ]
+
+
+def _plain_report(report_dict):
+    return dict((project, dict(logs)) for project, logs in report_dict.items())
+
+
+def calculate_file(args):
+    """Calculates stats of a log file or its chunk, see log_parser.calculate
+
+    Takes a tuple of arguments and returns summed times and plain report
+    dicts, so it can be run and its result pickled by process pool.
+    offsets - (start, end) byte offsets of chunk, or None for the whole file
+    """
+    path, date_from, date_to, today, report, offsets = args
+    if offsets is None:
+        lines = list(iter_lines(path, date_from, date_to))
+    else:
+        lines = list(helpers.iter_log_file_lines(offsets[0], offsets[1], log_file=path))
+    work_time, slack_time, today_time, work_dict, slack_dict = calculate(
+        lines, date_from, date_to, today=today, report=report)
+    return sum(work_time), sum(slack_time), today_time, _plain_report(work_dict), _plain_report(slack_dict)
+
+
+def _jobs(jobs, tasks):
+    return min(jobs or multiprocessing.cpu_count(), len(tasks))
+
+
+def run(tasks, jobs):
+    """Calculates tasks in a process pool of jobs processes and merges their stats
+
+    Work and slack time lists contain a sum for each task.
+    """
+    with profiling.phase('parse'):
+        if jobs > 1:
+            pool = multiprocessing.Pool(jobs)
+            try:
+                results = pool.map(calculate_file, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [calculate_file(task) for task in tasks]
+
+    work_time, slack_time = [], []
+    today_time = None
+    work_dict, slack_dict = new_report_dict(), new_report_dict()
+    for task_work, task_slack, task_today, task_work_dict, task_slack_dict in results:
+        work_time.append(task_work)
+        slack_time.append(task_slack)
+        if task_today is not None:
+            # the earliest start of the day
+            today_time = max(today_time or 0, task_today)
+        merge_report(work_dict, task_work_dict)
+        merge_report(slack_dict, task_slack_dict)
+    return work_time, slack_time, today_time, work_dict, slack_dict
+
+
+def calculate_files(patterns, date_from, date_to, today=False, report=True, jobs=None):
+    """Calculates merged stats of log files matching patterns, see log_parser.calculate
+
+    jobs - number of processes, defaults to the number of CPUs. Work and
+    slack time lists contain a sum for each log file.
+    """
+    paths = prune(expand_paths(patterns), date_from, date_to)
+    tasks = [(path, date_from, date_to, today, report, None) for path in paths]
+    return run(tasks, _jobs(jobs, tasks))
+
+
+def split_chunks(index, date_from, date_to, count):
+    """Returns (start, end) byte offsets of up to count chunks of date range
+
+    Chunks start at offsets of dates, so no day is split between chunks.
+    """
+    start, end = log_index.find_offsets(index, date_from, date_to)
+    if end is None:
+        end = index['size']
+    offsets = [offset for _, offset in index['dates']]
+    edges = [start]
+    for i in range(1, count):
+        target = start + (end - start) * i // count
+        j = bisect_left(offsets, target)
+        # offset of date nearest to target, which is after the previous edge
+        candidates = [offset for offset in offsets[max(j - 1, 0):j + 1] if edges[-1] < offset < end]
+        if candidates:
+            edges.append(min(candidates, key=lambda offset: abs(offset - target)))
+    edges.append(end)
+    return list(zip(edges, edges[1:]))
+
+
+def calculate_chunks(date_from, date_to, today=False, report=True, jobs=None, log_file=None):
+    """Calculates stats of log file by parsing chunks of date range in parallel
+
+    log_file defaults to LOG_FILE. Returns None if log file has no up to
+    date index of ordered dates, or if jobs aren't given and date range is
+    smaller than PARALLEL_MIN_SIZE.
+    """
+    log_file = log_file or helpers.LOG_FILE
+    index = log_index.load_index(log_file)
+    if index is None or not index['ordered']:
+        return None
+    start, end = log_index.find_offsets(index, date_from, date_to)
+    size = (index['size'] if end is None else end) - start
+    if jobs is None and size < PARALLEL_MIN_SIZE:
+        return None
+
+    chunks = split_chunks(index, date_from, date_to, jobs or multiprocessing.cpu_count())
+    # only the first chunk can contain the first line of the day
+    tasks = [(log_file, date_from, date_to, today and i == 0, report, chunk)
+             for i, chunk in enumerate(chunks)]
+    return run(tasks, _jobs(jobs, tasks))
@@ -0,0 +1,126 @@
+"""Per-phase wall time instrumentation
+
+When enabled with `--profile` option or TIMEFLOW_PROFILE environment
+variable, time spent in each phase (import, read, date lookup, parse,
+aggregation, rendering) is recorded and printed to stderr. Phases are
+exclusive: time of a nested phase is not counted in its parent phase.
+With `--profile-output FILE` (or TIMEFLOW_PROFILE_OUTPUT), cProfile stats
+are dumped to FILE as well, e.g. to inspect them with pstats or snakeviz.
+"""
+from __future__ import print_function
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+import sys
+import time
+
+
+# this module is imported first, so imports are timed from here
+STARTED = time.time()
+
+_enabled = False
+_phases = OrderedDict()
+# stack of [phase name, time since which the phase is being timed]
+_stack = []
+
+
+def is_enabled():
+    return _enabled
+
+
+def env_enabled():
+    return os.environ.get('TIMEFLOW_PROFILE', '0') not in ('', '0')
+
+
+def env_output():
+    return os.environ.get('TIMEFLOW_PROFILE_OUTPUT') or None
+
+
+def add(name, seconds):
+    "Adds seconds to phase time"
+    _phases[name] = _phases.get(name, 0) + seconds
+
+
+def start(name):
+    now = time.time()
+    if _stack:
+        parent = _stack[-1]
+        add(parent[0], now - parent[1])
+    _stack.append([name, now])
+
+
+def stop():
+    now = time.time()
+    name, since = _stack.pop()
+    add(name, now - since)
+    if _stack:
+        _stack[-1][1] = now
+
+
+@contextmanager
+def phase(name):
+    "Times the block as phase name, if profiling is enabled"
+    if not _enabled:
+        yield
+        return
+    start(name)
+    try:
+        yield
+    finally:
+        stop()
+
+
+def timed(name, fn):
+    "Returns fn wrapped to time its calls as phase name, or fn if profiling is disabled"
+    if not _enabled:
+        return fn
+
+    def _timed(*args, **kwargs):
+        start(name)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stop()
+    return _timed
+
+
+def format_report():
+    total = time.time() - STARTED
+    lines = ['timeflow profile:']
+    for name, seconds in _phases.items():
+        lines.append('  {:<12} {:>9.2f} ms'.format(name, seconds * 1000))
+    lines.append('  {:<12} {:>9.2f} ms'.format('total', total * 1000))
+    return '\n'.join(lines)
+
+
+@contextmanager
+def profile(enabled=False, output=None, imported=None):
+    """Profiles the block, printing phase times to stderr when it's done
+
+    imported - time when timeflow modules got imported, it's counted
+    as import phase
+    """
+    global _enabled
+    if not (enabled or output):
+        yield
+        return
+
+    _enabled = True
+    _phases.clear()
+    if imported is not None:
+        add('import', imported - STARTED)
+
+    profiler = None
+    if output:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(output)
+        _enabled = False
+        print(format_report(), file=sys.stderr)
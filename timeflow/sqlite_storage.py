@@ -0,0 +1,169 @@
+"""SQLite log file storage
+
+Each line of text log file is a row of entries table, comments and blank
+lines have no minute. Entries are indexed by their minutes since epoch and
+by project, so stats of a date range are calculated by an indexed range
+scan, with time differences of consecutive entries summed up by GROUP BY in
+the database engine.
+"""
+import os
+import sqlite3
+
+from timeflow import helpers
+from timeflow import profiling
+from timeflow.columnar import ColumnarLog, minutes_to_date, minutes_to_time
+from timeflow.log_parser import (
+    MINUTES_IN_DAY,
+    Line,
+    date_to_minutes,
+    new_report_dict,
+    parse_entry,
+    strip_log,
+    today_work_time,
+)
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    minute INTEGER,
+    slack INTEGER NOT NULL DEFAULT 0,
+    project TEXT,
+    log TEXT,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_minute ON entries (minute);
+CREATE INDEX IF NOT EXISTS entries_project ON entries (project, minute);
+'''
+
+INSERT = 'INSERT INTO entries (minute, slack, project, log, text) VALUES (?, ?, ?, ?, ?)'
+
+# pairs of consecutive entries of the same day in minute range, with time
+# differences wrapped to a day like log_parser.calc_time_diff does
+PAIRS = '''
+SELECT id, slack, project, log, ((minute - prev_minute) % {day} + {day}) % {day} * 60 AS seconds
+FROM (
+    SELECT id, slack, project, log, minute, LAG(minute) OVER (ORDER BY id) AS prev_minute
+    FROM entries
+    WHERE minute >= ? AND minute < ?
+)
+WHERE minute / {day} = prev_minute / {day}
+'''.format(day=MINUTES_IN_DAY)
+
+
+def entry_row(line):
+    "Returns entries table row of text log file line"
+    parsed = parse_entry(line)
+    if parsed is None:
+        return None, 0, None, None, line
+    return parsed.minute, int(parsed.is_slack), parsed.project, parsed.log, line
+
+
+def minute_range(date_from, date_to):
+    "Returns minutes since epoch from the start of date_from to the end of date_to"
+    return date_to_minutes(date_from), date_to_minutes(date_to) + MINUTES_IN_DAY
+
+
+class SqliteStorage():
+    "Log file kept in SQLite database"
+    is_text = False
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+
+    def exists(self):
+        return os.path.exists(self.log_file)
+
+    def connect(self):
+        db = sqlite3.connect(self.log_file)
+        db.executescript(SCHEMA)
+        return db
+
+    def _query(self, sql, params=()):
+        "Returns rows of query, or no rows if database doesn't exist yet"
+        if not self.exists():
+            return []
+        db = self.connect()
+        try:
+            return db.execute(sql, params).fetchall()
+        finally:
+            db.close()
+
+    def append(self, data):
+        "Appends lines of text in a single transaction"
+        db = self.connect()
+        try:
+            with db:
+                db.executemany(INSERT, (entry_row(line) for line in helpers.split_lines(data)))
+        finally:
+            db.close()
+
+    def write(self, lines):
+        "Replaces all lines in a single transaction, e.g. to import text log file"
+        db = self.connect()
+        try:
+            with db:
+                db.execute('DELETE FROM entries')
+                db.executemany(INSERT, (entry_row(line) for line in lines))
+        finally:
+            db.close()
+
+    def read_lines(self, date_from=None, date_to=None):
+        "Returns entry lines of date range"
+        sql = 'SELECT text FROM entries WHERE minute IS NOT NULL'
+        params = ()
+        if date_from is not None or date_to is not None:
+            minute_from, minute_to = minute_range(date_from or '1970-01-01', date_to or '9999-12-31')
+            sql = 'SELECT text FROM entries WHERE minute >= ? AND minute < ?'
+            params = (minute_from, minute_to)
+        return [text for text, in self._query(sql + ' ORDER BY id', params)]
+
+    def read_last_entry(self):
+        rows = self._query('SELECT text FROM entries WHERE minute IS NOT NULL ORDER BY id DESC LIMIT 1')
+        return rows[0][0] if rows else None
+
+    def iter_text(self):
+        "Yields all lines, including comments and blank lines"
+        for text, in self._query('SELECT text FROM entries ORDER BY id'):
+            yield text
+
+    def calculate(self, date_from, date_to, today=False, report=True):
+        """Calculates stats of date range in the database, see log_parser.calculate
+
+        Work and slack time lists contain a sum for each group of pairs.
+        """
+        params = minute_range(date_from, date_to)
+        work_time, slack_time = [], []
+        work_dict, slack_dict = new_report_dict(), new_report_dict()
+
+        with profiling.phase('aggregation'):
+            if report:
+                # groups are ordered by their first pair, like report dicts of text log file
+                sql = ('SELECT slack, project, log, SUM(seconds) FROM ({}) '
+                       'GROUP BY slack, project, log ORDER BY MIN(id)')
+            else:
+                sql = 'SELECT slack, NULL, NULL, SUM(seconds) FROM ({}) GROUP BY slack'
+            for slack, project, log_message, seconds in self._query(sql.format(PAIRS), params):
+                (slack_time if slack else work_time).append(seconds)
+                if report:
+                    report_dict = slack_dict if slack else work_dict
+                    report_dict[strip_log(project)][strip_log(log_message)] += seconds
+
+            today_time = None
+            if today:
+                rows = self._query('SELECT minute FROM entries WHERE minute >= ? AND minute < ? '
+                                   'ORDER BY id LIMIT 1', params)
+                if rows:
+                    minute = rows[0][0]
+                    today_time = today_work_time(
+                        Line(minutes_to_date(minute), minutes_to_time(minute), '', '', False, minute))
+        return work_time, slack_time, today_time, work_dict, slack_dict
+
+    def load_log(self):
+        "Returns ColumnarLog of entries"
+        log = ColumnarLog()
+        rows = self._query('SELECT minute, slack, project, log FROM entries '
+                           'WHERE minute IS NOT NULL ORDER BY id')
+        log.extend(Line(None, None, project, log_message, bool(slack), minute)
+                   for minute, slack, project, log_message in rows)
+        return log
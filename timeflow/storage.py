@@ -0,0 +1,212 @@
+"""Log file storages
+
+Log entries are kept in a plain text file by default. Log file ending with
+.tfb is kept in binary format (see binlog module), and one ending with
+.sqlite or .db in an SQLite database. write_to_log_file, read_log_file_lines
+and read_last_entry of helpers module work on any of them.
+
+Every storage keeps all lines of text log file, including comments and
+blank lines, so log file can be converted between storages without losing
+anything, e.g. to edit it as text.
+
+Writers hold an advisory lock of log file, taken on a lock file next to it
+(see locked), so entries written concurrently, e.g. by `tf log` from
+several terminals, don't interleave.
+"""
+from contextlib import contextmanager
+import os
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks on Windows, writes aren't serialized there
+    fcntl = None
+
+from timeflow import helpers
+from timeflow import log_index
+from timeflow import profiling
+
+
+BINARY_LOG_SUFFIX = '.tfb'
+LOCK_SUFFIX = '.lock'
+SQLITE_LOG_SUFFIXES = ('.sqlite', '.sqlite3', '.db')
+
+
+class TextStorage():
+    "Plain text log file, indexed by dates of its entries"
+    is_text = True
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+
+    def exists(self):
+        return os.path.exists(self.log_file)
+
+    def append(self, data):
+        "Appends lines of text, updating index and day summaries of log file"
+        # index has to be loaded before appending, while it's still up to date
+        index = log_index.load_index(self.log_file)
+        log_stat = helpers.log_file_stat(self.log_file)
+        offset = log_stat[0] if log_stat else 0
+        with open(self.log_file, 'a') as fp:
+            fp.write(data)
+        log_index.update_index(self.log_file, index, offset, data.encode('utf-8'))
+
+        # imported here, as summaries module depends on log_parser, which imports helpers
+        from timeflow import summaries
+        summaries.update(self.log_file, log_stat, data)
+
+    def read_lines(self, date_from=None, date_to=None):
+        """Returns entry lines
+
+        If date range is passed and log file index is up to date, only the
+        part of log file containing the date range is read.
+        """
+        start, end = 0, None
+        if date_from is not None or date_to is not None:
+            index = log_index.load_index(self.log_file)
+            if index is not None:
+                start, end = log_index.find_offsets(index, date_from, date_to)
+        return list(helpers.iter_log_file_lines(start, end, log_file=self.log_file))
+
+    def read_last_entry(self):
+        """Returns the last entry line, or None if there is none
+
+        Log file is read backwards from its end in blocks of TAIL_BLOCK_SIZE,
+        skipping blank lines and comments, so it takes constant time and
+        memory no matter how big the log file is.
+        """
+        try:
+            fp = open(self.log_file, 'rb')
+        except IOError:
+            return None
+
+        with fp:
+            fp.seek(0, os.SEEK_END)
+            end = fp.tell()
+            partial = b''
+            while end > 0:
+                start = max(0, end - helpers.TAIL_BLOCK_SIZE)
+                fp.seek(start)
+                lines = (fp.read(end - start) + partial).split(b'\n')
+                end = start
+
+                # first line of the block may be incomplete, unless it's a file start
+                if start > 0:
+                    partial = lines.pop(0)
+                for line in reversed(lines):
+                    line = line.decode('utf-8') + '\n'
+                    if helpers._is_valid_line(line):
+                        return line
+        return None
+
+    def iter_text(self):
+        "Yields all lines, including comments and blank lines"
+        with open(self.log_file, 'rb') as fp:
+            text = fp.read().decode('utf-8')
+        for line in helpers.split_lines(text):
+            yield line
+
+    def write(self, lines):
+        "Atomically replaces log file with lines, updating its index and day summaries"
+        tmp_path = self.log_file + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            for line in lines:
+                fp.write(line.encode('utf-8'))
+        os.rename(tmp_path, self.log_file)
+        log_index.rebuild_index(self.log_file)
+
+        from timeflow import summaries
+        summaries.revalidate(self.log_file)
+
+    def calculate(self, date_from, date_to, today=False, report=True):
+        "Text log file is calculated by the generic pipeline of stats command"
+        return None
+
+
+class BinaryStorage():
+    "Binary log file of fixed-width records, see binlog module"
+    is_text = False
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+
+    def exists(self):
+        return os.path.exists(self.log_file)
+
+    def append(self, data):
+        from timeflow import binlog
+        binlog.append(self.log_file, data)
+
+    def read_lines(self, date_from=None, date_to=None):
+        from timeflow import binlog
+        return binlog.read_lines(self.log_file, date_from, date_to)
+
+    def read_last_entry(self):
+        from timeflow import binlog
+        return binlog.read_last_entry(self.log_file)
+
+    def iter_text(self):
+        from timeflow import binlog
+        return binlog.iter_text(self.log_file)
+
+    def write(self, lines):
+        from timeflow import binlog
+        binlog.write(self.log_file, lines)
+
+    def calculate(self, date_from, date_to, today=False, report=True):
+        from timeflow.log_parser import calculate
+        with profiling.phase('read'):
+            log = self.load_log()
+        return calculate(log, date_from, date_to, today=today, report=report)
+
+    def load_log(self):
+        from timeflow import binlog
+        return binlog.load_log(self.log_file)
+
+
+def lock_path(log_file):
+    return log_file + LOCK_SUFFIX
+
+
+@contextmanager
+def locked(log_file=None):
+    """Holds an exclusive advisory lock of log file, log_file defaults to LOG_FILE
+
+    Lock is taken on lock file next to log file rather than on log file
+    itself, as log file is replaced by rename, when it's rewritten, and
+    a writer waiting for the lock of the replaced file wouldn't exclude
+    writers of the new one.
+    """
+    with open(lock_path(log_file or helpers.LOG_FILE), 'ab') as fp:
+        if fcntl is not None:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+
+
+def get_storage(log_file=None):
+    "Returns storage of log file by its name, log_file defaults to LOG_FILE"
+    if log_file is None:
+        log_file = helpers.LOG_FILE
+    if log_file.endswith(BINARY_LOG_SUFFIX):
+        return BinaryStorage(log_file)
+    if log_file.endswith(SQLITE_LOG_SUFFIXES):
+        from timeflow.sqlite_storage import SqliteStorage
+        return SqliteStorage(log_file)
+    return TextStorage(log_file)
+
+
+def convert(source, destination):
+    "Converts log file to another storage, e.g. text log file to binary or SQLite one"
+    source_storage = get_storage(source)
+    destination_storage = get_storage(destination)
+    if type(source_storage) is type(destination_storage):
+        sys.exit('Source and destination must be log files of different formats, e.g. '
+                 'timelog.txt and timelog{}'.format(BINARY_LOG_SUFFIX))
+    with locked(destination):
+        destination_storage.write(source_storage.iter_text())
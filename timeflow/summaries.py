@@ -0,0 +1,433 @@
+"""Persisted per-day aggregates of log file
+
+Every day of log file is summarised into a record of its work and slack
+seconds and report dictionaries, so stats of a range become a sum of day
+records instead of a rescan of raw lines. Records are kept in one file per
+month under cache directory, next to a meta file with log file size and
+modification time.
+
+Records are updated incrementally when entries are appended by
+`tf log`. Each record keeps a CRC of its day's entry lines, so when log
+file is changed otherwise (e.g. by `tf edit`), only the records of the
+days which actually changed are dropped, to be recomputed on demand.
+
+Day records are rolled up into ISO week, month and year records, so stats
+of a long range are a sum of a few rollups plus the days at its edges.
+A rollup is dropped as soon as any of its days changes.
+
+Day records are only valid for chronologically ordered log files, stats
+of other files are calculated from raw lines.
+"""
+from bisect import bisect_left
+from datetime import date as date_cls
+from datetime import datetime as dt
+from datetime import timedelta
+from itertools import groupby
+import calendar
+import os
+import zlib
+
+from timeflow import helpers
+from timeflow import log_index
+from timeflow.log_parser import (
+    MINUTES_IN_DAY,
+    Line,
+    aggregate_lines,
+    merge_report,
+    new_report_dict,
+    parse_line,
+    strip_log,
+    today_work_time,
+)
+
+
+SUMMARIES_VERSION = 1
+# length of 'YYYY-MM' string
+MONTH_LEN = 7
+# length of 'YYYY' string
+YEAR_LEN = 4
+
+
+def summaries_dir(log_file):
+    from timeflow.cache import cache_path
+    return os.path.splitext(cache_path(log_file))[0] + '.days'
+
+
+def load_meta(log_file):
+    meta = helpers.read_marshal(os.path.join(summaries_dir(log_file), 'meta'))
+    if not isinstance(meta, dict) or meta.get('version') != SUMMARIES_VERSION:
+        return None
+    return meta
+
+
+def save_meta(log_file, meta):
+    helpers.write_marshal(os.path.join(summaries_dir(log_file), 'meta'), meta)
+
+
+def load_month(log_file, month):
+    "Returns day records of 'YYYY-MM' month"
+    return helpers.read_marshal(os.path.join(summaries_dir(log_file), month)) or {}
+
+
+def save_month(log_file, month, days):
+    helpers.write_marshal(os.path.join(summaries_dir(log_file), month), days)
+
+
+def rollups_dir(log_file):
+    return os.path.join(summaries_dir(log_file), 'rollups')
+
+
+def load_rollup(log_file, key):
+    "Returns rollup record of period key: 'YYYY', 'YYYY-MM' or ISO week 'YYYY-Www'"
+    return helpers.read_marshal(os.path.join(rollups_dir(log_file), key))
+
+
+def save_rollup(log_file, key, record):
+    helpers.write_marshal(os.path.join(rollups_dir(log_file), key), record)
+
+
+def _new_meta(size, mtime, last_date=None):
+    return {
+        'version': SUMMARIES_VERSION,
+        'size': size,
+        'mtime': mtime,
+        'last_date': last_date,
+        'ordered': True,
+    }
+
+
+def _line_crc(line, crc=0):
+    return zlib.crc32(line.encode('utf-8'), crc) & 0xffffffff
+
+
+def revalidate(log_file):
+    """Drops records of days, which were changed in log file since the last run
+
+    Reads the whole log file, but doesn't parse it.
+    Returns up to date meta.
+    """
+    size, mtime = helpers.log_file_stat(log_file)
+    crcs = {}
+    last_date = None
+    ordered = True
+    for line in helpers.iter_log_file_lines(log_file=log_file):
+        date = line[:helpers.DATE_LEN]
+        if last_date is not None and date < last_date:
+            ordered = False
+        last_date = max(date, last_date or date)
+        crcs[date] = _line_crc(line, crcs.get(date, 0))
+
+    directory = summaries_dir(log_file)
+    months = os.listdir(directory) if os.path.isdir(directory) else []
+    recorded, dropped = set(), set()
+    for month in months:
+        if len(month) != MONTH_LEN or month[YEAR_LEN] != '-':
+            continue
+        days = load_month(log_file, month)
+        valid = dict(
+            (date, record) for date, record in days.items()
+            if ordered and crcs.get(date) == record['crc']
+        )
+        if len(valid) != len(days):
+            save_month(log_file, month, valid)
+        recorded.update(valid)
+        dropped.update(set(days) - set(valid))
+
+    # rollups of days, which were changed, removed or added, are out of date
+    _drop_rollups(log_file, dropped | (set(crcs) - recorded) if ordered else None)
+
+    meta = _new_meta(size, mtime, last_date)
+    meta['ordered'] = ordered
+    save_meta(log_file, meta)
+    return meta
+
+
+def update(log_file, log_stat, data):
+    """Updates day records after data was appended to log file
+
+    log_stat - log file size and modification time before appending
+    data - appended text
+    """
+    meta = load_meta(log_file)
+    if meta is None or log_stat is None or (meta['size'], meta['mtime']) != log_stat:
+        # records are out of date, they will be revalidated by stats
+        return
+
+    months = {}
+    changed = set()
+    dates = set()
+    for raw_line in data.splitlines(True):
+        if not helpers._is_valid_line(raw_line):
+            continue
+        line = parse_line(raw_line)
+        dates.add(line.date)
+        if meta['last_date'] is not None and line.date < meta['last_date']:
+            meta['ordered'] = False
+        meta['last_date'] = max(line.date, meta['last_date'] or line.date)
+
+        month = line.date[:MONTH_LEN]
+        if month not in months:
+            months[month] = load_month(log_file, month)
+        record = months[month].get(line.date)
+        # record is computed by stats, when the day is requested first time
+        if record is not None:
+            _add_line(record, line, raw_line)
+            changed.add(month)
+
+    for month in changed:
+        save_month(log_file, month, months[month])
+    if dates:
+        _drop_rollups(log_file, dates if meta['ordered'] else None)
+    meta['size'], meta['mtime'] = helpers.log_file_stat(log_file)
+    save_meta(log_file, meta)
+
+
+def _add_line(record, line, raw_line):
+    "Adds the pair of day's last line and line to day record"
+    time_diff = (line.minute - record['last_minute']) % MINUTES_IN_DAY * 60
+    if line.is_slack:
+        record['slack'] += time_diff
+        report = record['slack_report']
+    else:
+        record['work'] += time_diff
+        report = record['work_report']
+
+    project = strip_log(line.project)
+    log_message = strip_log(line.log)
+    logs = report.setdefault(project, {})
+    logs[log_message] = logs.get(log_message, 0) + time_diff
+
+    record['last_minute'] = line.minute
+    record['crc'] = _line_crc(raw_line, record['crc'])
+
+
+def _make_record(lines):
+    "Returns day record of day's log file lines"
+    data = [parse_line(line) for line in lines]
+    work_time, slack_time, work_dict, slack_dict, first_line = aggregate_lines(data)
+    crc = 0
+    for line in lines:
+        crc = _line_crc(line, crc)
+    return {
+        'work': sum(work_time),
+        'slack': sum(slack_time),
+        'work_report': dict((project, dict(logs)) for project, logs in work_dict.items()),
+        'slack_report': dict((project, dict(logs)) for project, logs in slack_dict.items()),
+        'first_time': first_line.time,
+        'last_minute': data[-1].minute,
+        'crc': crc,
+    }
+
+
+def _compute_days(log_file, dates, months, needed=None):
+    """Computes missing records of dates, reading each run of consecutive dates at once
+
+    needed - set of dates to compute, all of dates by default
+    """
+    changed = set()
+    for date_from, date_to in _date_runs(dates, months, needed):
+        lines = helpers.read_log_file_lines(date_from, date_to)
+        for date, day_lines in groupby(lines, key=lambda line: line[:helpers.DATE_LEN]):
+            month = date[:MONTH_LEN]
+            months[month][date] = _make_record(list(day_lines))
+            changed.add(month)
+    for month in changed:
+        save_month(log_file, month, months[month])
+
+
+def _date_runs(dates, months, needed=None):
+    "Yields (first, last) dates of runs of consecutive needed dates without records"
+    run = None
+    for date in dates:
+        if (needed is not None and date not in needed) or date in months[date[:MONTH_LEN]]:
+            if run is not None:
+                yield run
+                run = None
+        elif run is None:
+            run = [date, date]
+        else:
+            run[1] = date
+    if run is not None:
+        yield run
+
+
+def _to_date(date):
+    return dt.strptime(date, helpers.DATE_FORMAT).date()
+
+
+def _week_key(day):
+    return '{:04}-W{:02}'.format(*day.isocalendar()[:2])
+
+
+def period_range(key):
+    "Returns first and last dates of rollup period key"
+    if len(key) == YEAR_LEN:
+        return key + '-01-01', key + '-12-31'
+    if len(key) == MONTH_LEN:
+        year, month = int(key[:YEAR_LEN]), int(key[YEAR_LEN + 1:])
+        return key + '-01', '{}-{:02}'.format(key, calendar.monthrange(year, month)[1])
+    year, week = int(key[:YEAR_LEN]), int(key[YEAR_LEN + 2:])
+    # January 4th is always in the first ISO week of its year
+    jan_4 = date_cls(year, 1, 4)
+    monday = jan_4 + timedelta(days=-jan_4.weekday(), weeks=week - 1)
+    sunday = monday + timedelta(days=6)
+    return monday.strftime(helpers.DATE_FORMAT), sunday.strftime(helpers.DATE_FORMAT)
+
+
+def split_range(date_from, date_to):
+    """Splits date range into the fewest years, months, ISO weeks and days
+
+    Returns list of period keys, days are keyed by their dates. Weeks
+    crossing a month boundary are only used when the next month isn't
+    covered in full, so months and years stay aligned.
+    """
+    day, end = _to_date(date_from), _to_date(date_to)
+    keys = []
+    while day <= end:
+        month_end = date_cls(day.year, day.month, calendar.monthrange(day.year, day.month)[1])
+        next_month = month_end + timedelta(days=1)
+        next_month_end = next_month.replace(day=calendar.monthrange(next_month.year, next_month.month)[1])
+        week_end = day + timedelta(days=6)
+
+        if day.month == 1 and day.day == 1 and day.replace(month=12, day=31) <= end:
+            keys.append(str(day.year))
+            last = day.replace(month=12, day=31)
+        elif day.day == 1 and month_end <= end:
+            keys.append(day.strftime('%Y-%m'))
+            last = month_end
+        elif day.weekday() == 0 and week_end <= end and (week_end <= month_end or next_month_end > end):
+            keys.append(_week_key(day))
+            last = week_end
+        else:
+            keys.append(day.strftime(helpers.DATE_FORMAT))
+            last = day
+        day = last + timedelta(days=1)
+    return keys
+
+
+def _sum_records(records):
+    "Returns record of summed work and slack times and merged reports of records"
+    work_dict, slack_dict = new_report_dict(), new_report_dict()
+    work = slack = 0
+    for record in records:
+        work += record['work']
+        slack += record['slack']
+        merge_report(work_dict, record['work_report'])
+        merge_report(slack_dict, record['slack_report'])
+    return {
+        'work': work,
+        'slack': slack,
+        'work_report': dict((project, dict(logs)) for project, logs in work_dict.items()),
+        'slack_report': dict((project, dict(logs)) for project, logs in slack_dict.items()),
+    }
+
+
+def _rollup(key, dates, months, rollups):
+    "Returns rollup record of period key, computing it from its months or days if needed"
+    if key not in rollups:
+        if len(key) == YEAR_LEN:
+            children = [_rollup('{}-{:02}'.format(key, month), dates, months, rollups)
+                        for month in range(1, 13)]
+        else:
+            first, last = period_range(key)
+            children = [months[date[:MONTH_LEN]][date] for date in _dates_between(dates, first, last)]
+        rollups[key] = _sum_records(children)
+    return rollups[key]
+
+
+def _dates_between(dates, first, last):
+    "Returns dates of sorted dates list from first to last"
+    return dates[bisect_left(dates, first):bisect_left(dates, last + '~')]
+
+
+def _drop_rollups(log_file, dates):
+    "Drops rollups of periods containing any of dates, or all of them if dates is None"
+    directory = rollups_dir(log_file)
+    if not os.path.isdir(directory):
+        return
+    if dates is None:
+        keys = os.listdir(directory)
+    else:
+        keys = set()
+        for date in dates:
+            keys.update((date[:YEAR_LEN], date[:MONTH_LEN], _week_key(_to_date(date))))
+    for key in keys:
+        try:
+            os.remove(os.path.join(directory, key))
+        except OSError:
+            pass
+
+
+def calculate(date_from, date_to, today=False, report=True):
+    """Calculates stats of date range from day records and rollups, see log_parser.calculate
+
+    Work and slack time lists contain sums of periods. Returns None if
+    records can't be used, e.g. log file has no up to date index or it's
+    not in chronological order.
+    """
+    log_file = helpers.LOG_FILE
+    index = log_index.load_index(log_file)
+    if index is None or not index['ordered']:
+        return None
+
+    meta = load_meta(log_file)
+    if meta is None or (meta['size'], meta['mtime']) != helpers.log_file_stat(log_file):
+        meta = revalidate(log_file)
+    if not meta['ordered']:
+        return None
+
+    all_dates = [date for date, _ in index['dates']]
+    dates = _dates_between(all_dates, date_from, date_to)
+    if not dates:
+        return [], [], None, new_report_dict(), new_report_dict()
+
+    # years without entries don't need to be split
+    try:
+        keys = split_range(max(date_from, dates[0][:YEAR_LEN] + '-01-01'),
+                           min(date_to, dates[-1][:YEAR_LEN] + '-12-31'))
+    except ValueError:
+        # not a valid date, e.g. given by user
+        return None
+
+    rollups = {}
+    for key in keys:
+        if len(key) != helpers.DATE_LEN:
+            record = load_rollup(log_file, key)
+            if record is not None:
+                rollups[key] = record
+    loaded = set(rollups)
+    # day records are needed for days outside rollups and for rollups, which aren't computed yet
+    needed = set()
+    for key in keys:
+        if len(key) == helpers.DATE_LEN:
+            needed.update(_dates_between(dates, key, key))
+        elif key not in rollups:
+            needed.update(_dates_between(dates, *period_range(key)))
+    if today:
+        needed.add(dates[0])
+    months = dict((month, load_month(log_file, month))
+                  for month in set(date[:MONTH_LEN] for date in needed))
+    _compute_days(log_file, dates, months, needed)
+
+    records = []
+    for key in keys:
+        if len(key) == helpers.DATE_LEN:
+            records.extend(months[key[:MONTH_LEN]][date] for date in _dates_between(dates, key, key))
+        else:
+            records.append(_rollup(key, dates, months, rollups))
+    for key in set(rollups) - loaded:
+        save_rollup(log_file, key, rollups[key])
+
+    work_time = [record['work'] for record in records]
+    slack_time = [record['slack'] for record in records]
+    work_dict, slack_dict = new_report_dict(), new_report_dict()
+    if report:
+        for record in records:
+            merge_report(work_dict, record['work_report'])
+            merge_report(slack_dict, record['slack_report'])
+
+    today_time = None
+    if today:
+        first_record = months[dates[0][:MONTH_LEN]][dates[0]]
+        today_time = today_work_time(Line(dates[0], first_record['first_time'], '', '', False))
+    return work_time, slack_time, today_time, work_dict, slack_dict
@@ -0,0 +1,172 @@
+"""Live today's stats, kept up to date with log file appends
+
+Text log file is followed like `tail -f`: only bytes appended since the
+last known offset are read, and each new entry is added to running work
+and slack counters and report dicts. Log file is read from its start of
+today once, by its index, and read again only if it was replaced or
+truncated, e.g. by `tf edit`, or when the day changes. Binary and SQLite
+log files calculate today's stats again, when they change.
+"""
+from __future__ import print_function
+
+from datetime import datetime as dt
+import os
+import sys
+import time
+
+from timeflow import helpers
+from timeflow import log_index
+from timeflow import storage
+from timeflow.log_parser import (
+    calc_time_diff,
+    new_report_dict,
+    parse_entry,
+    strip_log,
+    today_work_time,
+)
+
+
+# ANSI escape sequence moving cursor home and clearing the screen
+CLEAR_SCREEN = '\033[H\033[2J'
+
+
+class TodayStats():
+    "Work and slack time of a day of log file, updated with appended entries"
+
+    def __init__(self, log_file=None, date=None):
+        self.log_file = log_file or helpers.LOG_FILE
+        self.date = date or dt.now().strftime(helpers.DATE_FORMAT)
+        self.reset()
+
+    def reset(self):
+        "Drops counters, so the day is read again from log file on the next poll"
+        self.work_time = 0
+        self.slack_time = 0
+        self.work_dict = new_report_dict()
+        self.slack_dict = new_report_dict()
+        self.first_line = None
+        self.last_line = None
+        self.offset = None
+        self.partial = b''
+        self.file_id = None
+
+    def poll(self):
+        "Reads entries appended to log file since the last poll, returns True if stats changed"
+        try:
+            stat = os.stat(self.log_file)
+        except OSError:
+            changed = self.offset is not None
+            self.reset()
+            return changed
+
+        file_id = (stat.st_dev, stat.st_ino)
+        if self.offset is not None and (file_id != self.file_id or stat.st_size < self.offset):
+            # log file was replaced or truncated, appends can't be followed
+            self.reset()
+        if self.offset is None:
+            self.file_id = file_id
+            self.offset = self._day_offset()
+        if stat.st_size == self.offset:
+            return False
+
+        with open(self.log_file, 'rb') as fp:
+            fp.seek(self.offset)
+            data = self.partial + fp.read(stat.st_size - self.offset)
+        self.offset = stat.st_size
+
+        lines = data.split(b'\n')
+        # the last line is incomplete, until its line ending is appended
+        self.partial = lines.pop()
+        for line in lines:
+            self.add_line(line.rstrip(b'\r').decode('utf-8') + '\n')
+        return bool(lines)
+
+    def _day_offset(self):
+        "Returns offset of the first entry of the day, or 0 if log file has no up to date index"
+        index = log_index.load_index(self.log_file)
+        if index is None:
+            return 0
+        return log_index.find_offsets(index, self.date, self.date)[0]
+
+    def add_line(self, raw_line):
+        "Adds time since the previous entry of the day to counters"
+        if not raw_line.startswith(self.date):
+            return
+        line = parse_entry(raw_line)
+        if line is None:
+            return
+        if self.first_line is None:
+            self.first_line = line
+        if self.last_line is not None:
+            time_diff = calc_time_diff(self.last_line, line)
+            report_dict = self.slack_dict if line.is_slack else self.work_dict
+            if line.is_slack:
+                self.slack_time += time_diff
+            else:
+                self.work_time += time_diff
+            report_dict[strip_log(line.project)][strip_log(line.log)] += time_diff
+        self.last_line = line
+
+
+class StorageTodayStats():
+    "Today's stats of binary or SQLite log file, calculated again when it changes"
+
+    def __init__(self, log_file=None, date=None):
+        self.log_file = log_file or helpers.LOG_FILE
+        self.date = date or dt.now().strftime(helpers.DATE_FORMAT)
+        self.storage = storage.get_storage(self.log_file)
+        self.log_stat = None
+        self.work_time = self.slack_time = 0
+        self.work_dict, self.slack_dict = new_report_dict(), new_report_dict()
+        self.first_line = None
+
+    def poll(self):
+        log_stat = helpers.log_file_stat(self.log_file)
+        if log_stat == self.log_stat:
+            return False
+        self.log_stat = log_stat
+        work_time, slack_time, _, self.work_dict, self.slack_dict = self.storage.calculate(
+            self.date, self.date)
+        self.work_time, self.slack_time = sum(work_time), sum(slack_time)
+        lines = self.storage.read_lines(self.date, self.date)
+        self.first_line = parse_entry(lines[0]) if lines else None
+        return True
+
+
+def get_today_stats(log_file=None, date=None):
+    "Returns today's stats object of log file, following appends of text log file"
+    if storage.get_storage(log_file).is_text:
+        return TodayStats(log_file, date)
+    return StorageTodayStats(log_file, date)
+
+
+def render(stats, report=False, colorize=False):
+    "Prints stats, like `tf stats` does for today"
+    print(CLEAR_SCREEN, end='')
+    print(dt.now().strftime(helpers.DATETIME_FORMAT) + '\n')
+    if report:
+        helpers.print_report(stats.work_dict, stats.slack_dict, [stats.work_time], [stats.slack_time],
+                             colorize=colorize)
+    else:
+        helpers.print_stats([stats.work_time], [stats.slack_time], None)
+    if stats.first_line is not None:
+        helpers.print_today_work_time(today_work_time(stats.first_line))
+    sys.stdout.flush()
+
+
+def watch(interval=5, report=False, colorize=False):
+    """Redraws today's stats every interval seconds, until interrupted
+
+    Stats are started again, when the day changes.
+    """
+    stats = get_today_stats()
+    try:
+        while True:
+            today = dt.now().strftime(helpers.DATE_FORMAT)
+            if today != stats.date:
+                stats = get_today_stats(date=today)
+            stats.poll()
+            render(stats, report=report, colorize=colorize)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass